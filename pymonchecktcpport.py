@@ -15,6 +15,26 @@
 #
 # --port - TCP/IP port to check
 # Ex: --port=80  - Scan TCP/IP port 80
+#
+# --sample - Connect latency sampling mode. Repeatedly open and close connections at --rate
+#            for --duration seconds and report connect time percentiles and histograms.
+#            --host and --port can be comma separated lists to sample several targets at once.
+#            Every host is sampled on every port. True/False Default=False
+# --rate - Sampling mode. Connections per second to each target. Must be greater than 0. Default=1
+# --duration - Sampling mode. Seconds to sample for. Must be greater than 0. Default=10
+# --timeout - Sampling mode. Seconds to wait for a connection or banner before counting a failure. Default=1
+# --banner - Sampling mode. Also wait for the first byte the service sends, such as a Telnet
+#            or FTP banner, and report the time to first byte from the start of the connect. True/False Default=False
+# --max-p95-ms - Sampling mode SLO. Fail when the 95th percentile connect time is above this value. Default=No limit
+# --max-p99-ms - Sampling mode SLO. Fail when the 99th percentile connect time is above this value. Default=No limit
+# --max-banner-p95-ms - Sampling mode SLO. Fail when the 95th percentile time to first byte is above this value. Default=No limit
+# --max-fail - Sampling mode SLO. Fail when the percent of failed connections is above this value. Default=No limit
+# --cachesecs - Share check results between jobs for this many seconds. A job running the same check
+#               within the window gets the cached result, and a job starting the same check while it
+#               is running waits for that result instead of opening another connection. 0=No caching. Default=0
+# --cachedir - Directory for shared check results and lock files. It is created writable by all user
+#              profiles. Point it at a directory owned by a group to share results only within that
+#              group. If the cache can't be used the check runs without it. Default=/tmp/pymoncache
 #------------------------------------------------
 
 import argparse
@@ -30,6 +50,11 @@ from datetime import date
 import datetime
 from configparser import ConfigParser
 import socket
+import selectors
+import errno
+import hashlib
+import json
+import fcntl
 
 #------------------------------------------------
 # Script initialization
@@ -52,6 +77,9 @@ datetime3=time.strftime("%m/%d/%y-%H%M%S")
 host=""
 port=""
 
+# Sampling mode latency histogram bucket upper bounds in milliseconds
+LATENCY_BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+
 #------------------------------------------------
 # Define some useful functions
 #------------------------------------------------
@@ -142,6 +170,257 @@ def DoesServiceExist(host,port):
    # All good, return true  
    return True
 
+def percentile(sortedvalues,pct):
+    #-------------------------------------------------------
+    # Function: percentile
+    # Desc: Nearest rank percentile of sorted values
+    # :sortedvalues: Sorted list of values
+    # :pct: Percentile between 0 and 100
+    # :return: Percentile value or None if there are no values
+    #-------------------------------------------------------
+    if len(sortedvalues) == 0:
+       return None
+    rank = max(1,int(-(-pct * len(sortedvalues) // 100)))
+    return sortedvalues[rank - 1]
+
+def SampleConnects(targets,rate,duration,timeout=1,banner=False):
+    #-------------------------------------------------------
+    # Function: SampleConnects
+    # Desc: Open and close connections to each target at a fixed rate
+    #       using non-blocking sockets and a single selector, so many
+    #       targets are sampled at once without a thread per target.
+    # :targets: List of (host, port) tuples
+    # :rate: Connections per second to each target
+    # :duration: Seconds to sample for
+    # :timeout: Seconds to wait for a connection or banner
+    # :banner: True=Also time the first byte sent by the service
+    # :return: Dictionary by target of attempts, failures, connect ms list,
+    #          banner ms list and error messages by count
+    #-------------------------------------------------------
+    sel = selectors.DefaultSelector()
+    results = {}
+    addrs = {}
+    for target in targets:
+        results[target] = {"attempts": 0, "failures": 0, "connect": [], "banner": [],
+                           "bannerfailures": 0, "errors": {}}
+        # Resolve once up front so name lookups aren't part of the connect time
+        family, socktype, proto, canonname, sockaddr = socket.getaddrinfo(target[0],target[1],type=socket.SOCK_STREAM)[0]
+        addrs[target] = (family,sockaddr)
+
+    def fail(attempt,error,bannerfail=False):
+        result = results[attempt["target"]]
+        if bannerfail:
+           result["bannerfailures"] += 1
+        else:
+           result["failures"] += 1
+        result["errors"][error] = result["errors"].get(error,0) + 1
+        close(attempt)
+
+    def close(attempt):
+        sel.unregister(attempt["sock"])
+        attempt["sock"].close()
+        pending.remove(attempt)
+
+    interval = 1.0 / rate
+    starttime = time.monotonic()
+    endtime = starttime + duration
+    # Stagger the targets across the interval to spread the connects out
+    nextdue = {target: starttime + interval * i / len(targets) for i, target in enumerate(targets)}
+    pending = []
+
+    while True:
+        now = time.monotonic()
+        # Start any connects that are due
+        for target in targets:
+            if nextdue[target] <= now and now < endtime:
+               nextdue[target] = max(nextdue[target] + interval,now - interval)
+               results[target]["attempts"] += 1
+               family, sockaddr = addrs[target]
+               sock = socket.socket(family,socket.SOCK_STREAM)
+               sock.setblocking(False)
+               attempt = {"target": target, "sock": sock, "start": now, "deadline": now + timeout, "connected": False}
+               pending.append(attempt)
+               sel.register(sock,selectors.EVENT_WRITE,attempt)
+               err = sock.connect_ex(sockaddr)
+               if err not in (0,errno.EINPROGRESS,errno.EWOULDBLOCK,errno.EALREADY):
+                  fail(attempt,os.strerror(err))
+
+        if now >= endtime and not pending:
+           break
+
+        # Wait for the next connect due or the nearest timeout
+        waits = [a["deadline"] for a in pending]
+        if now < endtime:
+           waits += list(nextdue.values())
+        wait = max(0,min(waits) - time.monotonic()) if waits else 0
+
+        for key, mask in sel.select(wait):
+            attempt = key.data
+            sock = attempt["sock"]
+            now = time.monotonic()
+            if not attempt["connected"]:
+               err = sock.getsockopt(socket.SOL_SOCKET,socket.SO_ERROR)
+               if err != 0:
+                  fail(attempt,os.strerror(err))
+                  continue
+               results[attempt["target"]]["connect"].append((now - attempt["start"]) * 1000)
+               if not banner:
+                  close(attempt)
+                  continue
+               attempt["connected"] = True
+               attempt["deadline"] = attempt["start"] + timeout
+               sel.modify(sock,selectors.EVENT_READ,attempt)
+            else:
+               try:
+                  data = sock.recv(1)
+               except OSError as ex:
+                  fail(attempt,str(ex),bannerfail=True)
+                  continue
+               if data:
+                  results[attempt["target"]]["banner"].append((now - attempt["start"]) * 1000)
+                  close(attempt)
+               else:
+                  fail(attempt,"Connection closed before banner",bannerfail=True)
+
+        # Expire attempts that took too long
+        now = time.monotonic()
+        for attempt in [a for a in pending if a["deadline"] <= now]:
+            fail(attempt,"Banner timeout" if attempt["connected"] else "Connect timeout",bannerfail=attempt["connected"])
+
+    sel.close()
+    return results
+
+def getcachekey(params):
+    #-------------------------------------------------------
+    # Function: getcachekey
+    # Desc: Build a cache key from normalized check parameters
+    # :params: Dictionary of check parameters
+    # :return: Hex key usable as a file name
+    #-------------------------------------------------------
+    return hashlib.sha1(json.dumps(params,sort_keys=True).encode()).hexdigest()
+
+def opencachefile(path,flags):
+    #-------------------------------------------------------
+    # Function: opencachefile
+    # Desc: Open a cache file readable and writable by every user profile
+    #       so jobs running under different profiles can share it. The
+    #       umask is undone with fchmod when this job owns the file.
+    # :path: File path
+    # :flags: os.open flags
+    # :return: File descriptor
+    #-------------------------------------------------------
+    fd = os.open(path,flags,0o666)
+    try:
+       os.fchmod(fd,0o666)
+    except OSError:
+       pass
+    return fd
+
+def runcachedcheck(cachedir,cachesecs,params,checkfunc):
+    #-------------------------------------------------------
+    # Function: runcachedcheck
+    # Desc: Share one check result between jobs running the same check.
+    #       An exclusive lock on the key's lock file is held while the
+    #       cached result is read and, if it is too old, while the check
+    #       runs. A job asking for the same check while it is running
+    #       waits on the lock and then gets the fresh result instead of
+    #       starting another probe. The cache directory and files are
+    #       created writable by all profiles. If the cache can't be used
+    #       the check still runs without it, so the cache never fails a check.
+    # :cachedir: Directory for the cache and lock files
+    # :cachesecs: Seconds a cached result stays fresh
+    # :params: Dictionary of normalized check parameters used as the key
+    # :checkfunc: Function that runs the check and returns a success
+    #             message or raises an exception on failure
+    # :return: Dictionary with ok, message, time and cached values
+    #-------------------------------------------------------
+    def runcheck():
+        try:
+           result = {"ok": True, "message": checkfunc()}
+        except Exception as ex:
+           result = {"ok": False, "message": str(ex)}
+        result["time"] = time.time()
+        result["cached"] = False
+        return result
+
+    key = getcachekey(params)
+    resultfile = os.path.join(cachedir,key + ".json")
+    try:
+       if not os.path.isdir(cachedir):
+          os.makedirs(cachedir,exist_ok=True)
+          try:
+             os.chmod(cachedir,0o777)
+          except OSError:
+             pass
+       lockfd = opencachefile(os.path.join(cachedir,key + ".lock"),os.O_RDWR | os.O_CREAT)
+    except OSError as ex:
+       print(f"Warning: Result cache not available. {ex}. Running check without the cache.")
+       return runcheck()
+
+    try:
+       try:
+          fcntl.lockf(lockfd,fcntl.LOCK_EX)
+       except OSError as ex:
+          print(f"Warning: Result cache lock failed. {ex}. Running check without the cache.")
+          return runcheck()
+       try:
+          with open(resultfile,"r") as f:
+             result = json.load(f)
+          if time.time() - result["time"] <= cachesecs:
+             result["cached"] = True
+             return result
+       except (OSError,ValueError,KeyError):
+          pass
+
+       result = runcheck()
+       try:
+          # Write to a temp file and rename so readers never see a partial result
+          tmpfile = resultfile + ".tmp"
+          with os.fdopen(opencachefile(tmpfile,os.O_WRONLY | os.O_CREAT | os.O_TRUNC),"w") as f:
+             json.dump(dict(result,params=params),f)
+          os.replace(tmpfile,resultfile)
+       except OSError as ex:
+          print(f"Warning: Result cache not saved. {ex}")
+       return result
+    finally:
+       # Closing the lock file releases the lock
+       os.close(lockfd)
+
+def PrintSampleResults(results,banner=False):
+    #-------------------------------------------------------
+    # Function: PrintSampleResults
+    # Desc: Output connect time percentiles and histogram for each target
+    # :results: Dictionary returned by SampleConnects
+    # :banner: True=Also output time to first byte percentiles
+    #-------------------------------------------------------
+    def fmtms(value):
+        return "" if value is None else f"{value:.2f}"
+
+    print("target|attempts|failures|failpct|p50ms|p95ms|p99ms|maxms" + ("|bannerfailures|bannerp50ms|bannerp95ms|bannerp99ms" if banner else ""))
+    for (host,port), result in results.items():
+        connect = sorted(result["connect"])
+        failpct = 100.0 * result["failures"] / result["attempts"] if result["attempts"] else 0.0
+        line = (f"{host}:{port}|{result['attempts']}|{result['failures']}|{failpct:.1f}|{fmtms(percentile(connect,50))}"
+                f"|{fmtms(percentile(connect,95))}|{fmtms(percentile(connect,99))}|{fmtms(connect[-1] if connect else None)}")
+        if banner:
+           bannerms = sorted(result["banner"])
+           line += (f"|{result['bannerfailures']}|{fmtms(percentile(bannerms,50))}|{fmtms(percentile(bannerms,95))}"
+                    f"|{fmtms(percentile(bannerms,99))}")
+        print(line)
+
+    print("target|connectms|count")
+    lows = [0] + LATENCY_BUCKETS
+    for (host,port), result in results.items():
+        counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        for ms in result["connect"]:
+            counts[sum(1 for b in LATENCY_BUCKETS if ms >= b)] += 1
+        for i, count in enumerate(counts):
+            if count > 0:
+               label = f"{lows[i]}-{LATENCY_BUCKETS[i]}" if i < len(LATENCY_BUCKETS) else f">={LATENCY_BUCKETS[-1]}"
+               print(f"{host}:{port}|{label}|{count}")
+        for error, count in result["errors"].items():
+            print(f"{host}:{port}|Error: {error}|{count}")
+
 #------------------------------------------------
 # Main script logic
 #------------------------------------------------
@@ -162,6 +441,17 @@ try: # Try to perform main logic
    parser = argparse.ArgumentParser()
    parser.add_argument('-s','--host', required=True,help="TCP/IP host name or IP address to check")
    parser.add_argument('-p','--port', required=True,help="TCP/IP port to check")
+   parser.add_argument('--sample',default=False,required=False,help="Connect latency sampling mode. Default=False")
+   parser.add_argument('--rate',default="1",required=False,help="Sampling connections per second per target. Default=1")
+   parser.add_argument('--duration',default="10",required=False,help="Sampling seconds. Default=10")
+   parser.add_argument('--timeout',default="1",required=False,help="Sampling connect/banner timeout seconds. Default=1")
+   parser.add_argument('--banner',default=False,required=False,help="Sampling time to first banner byte. Default=False")
+   parser.add_argument('--max-p95-ms',default="",required=False,help="Sampling SLO 95th percentile connect ms. Default=No limit")
+   parser.add_argument('--max-p99-ms',default="",required=False,help="Sampling SLO 99th percentile connect ms. Default=No limit")
+   parser.add_argument('--max-banner-p95-ms',default="",required=False,help="Sampling SLO 95th percentile banner ms. Default=No limit")
+   parser.add_argument('--max-fail',default="",required=False,help="Sampling SLO failed connection percent. Default=No limit")
+   parser.add_argument('--cachesecs',default="0",required=False,help="Seconds to share check results between jobs. 0=No caching. Default=0")
+   parser.add_argument('--cachedir',default="/tmp/pymoncache",required=False,help="Shared check result directory. Default=/tmp/pymoncache")
    # Parse the command line arguments 
    args = parser.parse_args()
 
@@ -177,16 +467,72 @@ try: # Try to perform main logic
    print(f"TCP/IP host: {host}")
    print(f"TCP/IP port: {port}")
 
-   # Check for app running on selected port
-   rtn1 = DoesServiceExist(host,int(port))
-   
-   if (rtn1==True):
-      msg = f"TCP/IP service exists on {host}:{port}"
+   if (str2bool(str(args.sample))):
+      # Sample connect times to every host/port combination at once
+      targets=[(h.strip(),int(p)) for h in host.split(",") for p in port.split(",")]
+      banner=str2bool(str(args.banner))
+      rate=float(args.rate)
+      duration=float(args.duration)
+      if (rate <= 0):
+         raise Exception(f"--rate must be greater than 0. Value passed: {args.rate}. Process cancelled.")
+      if (duration <= 0):
+         raise Exception(f"--duration must be greater than 0. Value passed: {args.duration}. Process cancelled.")
+      print(f"Sampling {len(targets)} targets at {rate:g} connections/sec for {duration:g} seconds")
+      results = SampleConnects(targets,rate,duration,float(args.timeout),banner)
+      PrintSampleResults(results,banner)
+
+      # Check each target against the SLO thresholds
+      slos=[("max_p95_ms","connect",95,"95th percentile connect"),
+            ("max_p99_ms","connect",99,"99th percentile connect"),
+            ("max_banner_p95_ms","banner",95,"95th percentile banner")]
+      violations=[]
+      for (h,p), result in results.items():
+         for argname, key, pct, desc in slos:
+            limit=getattr(args,argname)
+            value=percentile(sorted(result[key]),pct)
+            if (limit != "" and value is not None and value > float(limit)):
+               violations.append(f"{h}:{p} {desc} {value:.2f} ms is above {limit} ms")
+         failpct=100.0 * result["failures"] / result["attempts"] if result["attempts"] else 0.0
+         if (args.max_fail != "" and failpct > float(args.max_fail)):
+            violations.append(f"{h}:{p} failed connections {failpct:.1f}% is above {args.max_fail}%")
+         if (len(result["connect"])==0):
+            violations.append(f"{h}:{p} no connections succeeded")
+         elif (banner and len(result["banner"])==0):
+            violations.append(f"{h}:{p} no banner received")
+
+      if (len(violations) > 0):
+         for v in violations:
+            print(v)
+         raise Exception(f"TCP/IP connect SLO not met: {'; '.join(violations)}")
+      msg = f"TCP/IP connect SLO met for {len(targets)} targets"
       print (msg)
    else:
-      msg = f"TCP/IP service does NOT exist on {host}:{port}"
-      print (msg)
-      raise Exception(msg) 
+      def CheckService():
+         # Check for app running on selected port
+         rtn1 = DoesServiceExist(host,int(port))
+   
+         if (rtn1==True):
+            return f"TCP/IP service exists on {host}:{port}"
+         else:
+            raise Exception(f"TCP/IP service does NOT exist on {host}:{port}")
+
+      # Share the result with other jobs checking the same port if caching is enabled
+      cachesecs=float(args.cachesecs)
+      if (cachesecs > 0):
+         result = runcachedcheck(args.cachedir,cachesecs,{"check": "tcpport", "host": host.lower(), "port": int(port)},CheckService)
+         if (result["cached"]):
+            print(f"Using cached result from {time.time() - result['time']:.1f} seconds ago")
+         msg = result["message"]
+         print (msg)
+         if not (result["ok"]):
+            raise Exception(msg)
+      else:
+         try:
+            msg = CheckService()
+            print (msg)
+         except Exception as ex:
+            print (str(ex))
+            raise
 
    # Set success info
    exitcode=0
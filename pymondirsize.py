@@ -13,9 +13,69 @@
 # --dirtype - Directory type. ifs=IFS directory path, lib or library=10 character IBM i library name format. Default=ifs
 # --listfiles - Output detailed list of files and sizes including running total to quickly identify where large files may exist 
 #               in the directory. True=List all files,False=Don't list all files. Default=False
+# --duplicates - Find duplicate files instead of calculating total size. Files are bucketed by size, then
+#                compared by a partial hash of the first and last blocks and only the remaining candidates
+#                are fully hashed. Reports reclaimable bytes per duplicate group. True/False Default=False
+# --workers - Number of worker threads used to hash duplicate candidates, or worker processes
+#             used to size libraries with --all-libraries. Default=4
+# --analytics - Output size and age histograms plus totals by top level directory and file extension
+#               instead of the plain total. Stat results are kept in compact typed arrays. True/False Default=False
+# --olderthan - Age in days used for the bytes older than totals in analytics mode. Default=365
+# --watch - Do one initial scan and then keep the directory totals current from filesystem change
+#           notifications instead of rescanning. Uses inotify on Linux and falls back to polling
+#           where inotify is not available such as PASE. True/False Default=False
+# --interval - Watch mode report interval in seconds. Also the poll interval when polling. Default=60
+# --threshold - Watch mode total size threshold in bytes. A message is output each time the total
+#               crosses the threshold in either direction. 0=No threshold. Default=0
+# --duration - Watch mode run time in seconds. 0=Run until the job is ended. Default=0
+#              Sending SIGUSR1 to the process outputs the current totals on demand.
+# --exclude - Comma separated glob patterns of directories and files to skip. Patterns containing a /
+#             are matched against the full path, others against the name. Ex: --exclude=/QSYS.LIB,*.tmp
+#             Excluded directories are never read. Can be specified more than once.
+# --excluderegex - Regular expression searched for in the full path of directories and files to skip.
+#                  Can be specified more than once.
+# --include - Comma separated glob patterns of the files to count. Default=All files
+#             Can be specified more than once.
+# --includeregex - Regular expression searched for in the full path of the files to count.
+#                  Can be specified more than once.
+# --maxdepth - Number of directory levels below dirname to descend. 0=dirname only. -1=No limit. Default=-1
+# --samefs - Don't descend into directories on another file system. True/False Default=False
+# --objtypes - Comma separated QSYS.LIB object types to count within libraries. Ex: --objtypes=FILE,PGM
+#              Members are counted with their file when FILE is selected or on their own with MBR.
+#              Default=All object types
+# --checkpointfile - Periodically save the crawl state to this file so a long crawl can be resumed
+#                    with --resume if the job is ended. The file is removed when the crawl completes.
+#                    Used when calculating the total size or with --exportdir. An export saves a checkpoint
+#                    each time a chunk is committed, so --resume continues after the last finished chunk.
+#                    Default=No checkpoints
+# --checkpointsecs - Seconds between checkpoint saves when calculating the total size. Default=5
+# --resume - Resume the crawl from the last checkpoint in --checkpointfile. Starts a new crawl if no
+#            checkpoint exists. True/False Default=False
+# --maxops - Limit directory reads and file stats to this many operations per second so a crawl
+#            can run during business hours with predictable impact. 0=No limit. Default=0
+# --adaptive - Back off below --maxops while the average stat latency is above --maxlatencyms
+#              and recover once it drops. True/False Default=False
+# --maxlatencyms - Stat latency in milliseconds that triggers an adaptive back off. Default=20
+# --progresssecs - Output crawl progress and an estimated time remaining every this many seconds.
+#                  0=No progress messages. Default=0
+# --all-libraries - Size every library in the QSYS.LIB directory given by --dirname in parallel on a process
+#                   pool of --workers processes. Each library total is broken down by object type suffix
+#                   (.FILE, .PGM, .SRVPGM...) and libraries are listed largest first. Member sizes are
+#                   included in their .FILE total and the .MBR row lists the members on their own.
+#                   True/False Default=False
+# --exportdir - Stream a record for each file found into chunk files in this directory for bulk loading
+#               with CPYFRMIMPF or a SQL bulk import instead of listing them. Chunks are written while the crawl
+#               runs and only get their final name once complete, so loading can overlap with the crawl.
+#               A manifest.json file records the row count and SHA-256 checksum of each chunk. Default=No export
+# --exportformat - Chunk format. csv or jsonl. Default=csv
+# --exportcompress - gzip compress the chunk files. True/False Default=True
+# --exportchunkmb - Start a new chunk after this many MB of uncompressed records. Fractions such as 0.5
+#                  can be used. Default=100
 #
 # Pip packages needed:
 # None - argparse is a standard module.
+# numpy is optional. If installed the analytics passes are vectorized with numpy,
+# otherwise the standard array module is used.
 #
 # Returns:
 # Exits with 0 on success or 99 on errors.
@@ -34,9 +94,50 @@ import argparse
 import sys
 from sys import platform
 import os
+import stat
 import re
 import time
 import traceback
+import hashlib
+import mmap
+import bisect
+import fnmatch
+import json
+import csv
+import io
+import gzip
+import select
+import signal
+import struct
+import ctypes
+import ctypes.util
+import errno
+from array import array
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+# numpy is optional and only used to vectorize the analytics passes
+try:
+   import numpy
+except ImportError:
+   numpy = None
+
+# Analytics bucket upper bounds. Age in days and size in bytes.
+AGE_BUCKETS = [1, 7, 30, 90, 365, 730]
+SIZE_BUCKETS = [1024, 10240, 102400, 1048576, 10485760, 104857600, 1073741824]
+
+# inotify event masks from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+IN_WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM |
+                 IN_MOVED_TO | IN_CREATE | IN_DELETE)
 
 
 #------------------------------------------------
@@ -90,34 +191,1261 @@ def ltrim(strval):
     return strval.lstrip()
 
 
-def getdirsize(start_path = '.',list_files=False):
+def splitpatterns(values):
+    #-------------------------------------------------------
+    # Function: splitpatterns
+    # Desc: Flatten repeated comma separated command line values into a list
+    # :values: List of strings from an append argument or None
+    # :return: List of non blank values
+    #-------------------------------------------------------
+    patterns = []
+    for value in values or []:
+        patterns.extend(v.strip() for v in value.split(",") if v.strip())
+    return patterns
+
+class WalkRules:
+    #-------------------------------------------------------
+    # Class: WalkRules
+    # Desc: Exclude/include rules for the directory walker. Patterns are
+    #       compiled once into a single regular expression per rule type
+    #       and directory names are checked before descending, so an
+    #       excluded subtree is never read.
+    #-------------------------------------------------------
+
+    def __init__(self,excludes=None,exclude_regex=None,includes=None,include_regex=None,
+                 max_depth=-1,same_fs=False,obj_types=None):
+        self.excludename, self.excludepath = self.compile(excludes,exclude_regex)
+        self.includename, self.includepath = self.compile(includes,include_regex)
+        self.hasinclude = bool(includes or include_regex)
+        self.maxdepth = max_depth
+        self.samefs = same_fs
+        self.rootdev = None
+        self.objtypes = set(t.upper().lstrip("*.") for t in obj_types or [])
+
+    def compile(self,globs,regexes):
+        #-------------------------------------------------------
+        # Function: compile
+        # Desc: Combine glob and regex patterns into name and path matchers
+        # :globs: Glob patterns. Patterns containing a / match the full path.
+        # :regexes: Regular expressions searched for in the full path
+        # :return: Tuple of (name matcher, path matcher). Either may be None.
+        #-------------------------------------------------------
+        names = [fnmatch.translate(g) for g in globs or [] if "/" not in g]
+        paths = [fnmatch.translate(g.rstrip("/")) for g in globs or [] if "/" in g]
+        paths += [".*(?:" + r + ")" for r in regexes or []]
+        namere = re.compile("|".join(names)).match if names else None
+        pathre = re.compile("|".join("(?:" + p + ")" for p in paths)).match if paths else None
+        return namere, pathre
+
+    def matches(self,matchers,name,path):
+        namere, pathre = matchers
+        return bool((namere and namere(name)) or (pathre and pathre(path)))
+
+    def setroot(self,start_path):
+        #-------------------------------------------------------
+        # Function: setroot
+        # Desc: Remember the file system of the start directory for samefs
+        # :start_path: Directory the walk starts from
+        #-------------------------------------------------------
+        if self.samefs:
+           self.rootdev = os.stat(start_path).st_dev
+
+    def objtype(self,dirpath,name):
+        #-------------------------------------------------------
+        # Function: objtype
+        # Desc: Get the QSYS.LIB object type of a name in a library or file.
+        #       Names outside of QSYS.LIB style directories have no type.
+        # :dirpath: Parent directory path
+        # :name: Object name. Ex: QCLSRC.FILE
+        # :return: Parent type, object type. Ex: LIB, FILE or None, None
+        #-------------------------------------------------------
+        parenttype = os.path.splitext(dirpath.rstrip(os.sep))[1].upper().lstrip(".")
+        if parenttype not in ("LIB","FILE"):
+           return None, None
+        return parenttype, os.path.splitext(name)[1].upper().lstrip(".")
+
+    def allowdir(self,dirpath,name,depth,entry=None):
+        #-------------------------------------------------------
+        # Function: allowdir
+        # Desc: Check if a subdirectory should be descended into
+        # :dirpath: Parent directory path
+        # :name: Subdirectory name
+        # :depth: Depth of the subdirectory below the start directory
+        # :entry: os.DirEntry for the subdirectory, used for samefs
+        # :return: True=Descend, False=Skip subtree
+        #-------------------------------------------------------
+        if self.maxdepth >= 0 and depth > self.maxdepth:
+           return False
+        path = os.path.join(dirpath,name)
+        if self.matches((self.excludename,self.excludepath),name,path):
+           return False
+        if self.objtypes:
+           parenttype, objtype = self.objtype(dirpath,name)
+           if parenttype == "LIB" and objtype != "LIB":
+              if objtype == "FILE":
+                 if not ("FILE" in self.objtypes or "MBR" in self.objtypes):
+                    return False
+              elif objtype not in self.objtypes:
+                 return False
+        if self.samefs and self.rootdev is not None:
+           st = entry.stat(follow_symlinks=False) if entry is not None else os.lstat(path)
+           if st.st_dev != self.rootdev:
+              return False
+        return True
+
+    def allowfile(self,dirpath,name):
+        #-------------------------------------------------------
+        # Function: allowfile
+        # Desc: Check if a file should be counted
+        # :dirpath: Parent directory path
+        # :name: File name
+        # :return: True=Count file, False=Skip file
+        #-------------------------------------------------------
+        path = os.path.join(dirpath,name)
+        if self.matches((self.excludename,self.excludepath),name,path):
+           return False
+        if self.hasinclude and not self.matches((self.includename,self.includepath),name,path):
+           return False
+        if self.objtypes:
+           parenttype, objtype = self.objtype(dirpath,name)
+           if parenttype == "LIB" and objtype not in self.objtypes:
+              return False
+           if parenttype == "FILE" and not ("FILE" in self.objtypes or "MBR" in self.objtypes):
+              return False
+        return True
+
+class IoRateLimiter:
+    #-------------------------------------------------------
+    # Class: IoRateLimiter
+    # Desc: Token bucket limiting directory reads and stats to a number
+    #       of operations per second. In adaptive mode the rate is halved
+    #       while the average stat latency is above the threshold and
+    #       raised back in small steps once it recovers. Also outputs
+    #       periodic crawl progress for the walker.
+    #-------------------------------------------------------
+
+    def __init__(self,max_ops=0,adaptive=False,max_latency_ms=20,progress_secs=0):
+        self.maxrate = float(max_ops)
+        self.rate = self.maxrate
+        self.minrate = max(1.0,self.maxrate / 20)
+        self.adaptive = adaptive and max_ops > 0
+        self.maxlatency = max_latency_ms / 1000.0
+        self.latency = 0.0
+        # Allow bursts of up to a tenth of a second worth of operations
+        self.tokens = max(1.0,self.rate / 10)
+        self.lastrefill = time.monotonic()
+        self.lastadjust = self.lastrefill
+        self.ops = 0
+        self.progresssecs = progress_secs
+        self.starttime = time.monotonic()
+        self.nextprogress = self.starttime + progress_secs
+
+    def acquire(self):
+        #-------------------------------------------------------
+        # Function: acquire
+        # Desc: Wait until an operation is allowed by the current rate
+        #-------------------------------------------------------
+        self.ops += 1
+        if self.rate <= 0:
+           return
+        burst = max(1.0,self.rate / 10)
+        now = time.monotonic()
+        self.tokens = min(burst,self.tokens + (now - self.lastrefill) * self.rate)
+        self.lastrefill = now
+        if self.tokens < 1:
+           time.sleep((1 - self.tokens) / self.rate)
+           # Credit the time actually slept so oversleeping doesn't lower the rate
+           now = time.monotonic()
+           self.tokens = min(burst,self.tokens + (now - self.lastrefill) * self.rate)
+           self.lastrefill = now
+        self.tokens -= 1
+
+    def observe(self,seconds):
+        #-------------------------------------------------------
+        # Function: observe
+        # Desc: Record the latency of a stat call for progress output and
+        #       adjust the rate at most once a second when in adaptive mode
+        # :seconds: Elapsed time of the call
+        #-------------------------------------------------------
+        self.latency = self.latency * 0.9 + seconds * 0.1
+        if not self.adaptive:
+           return
+        now = time.monotonic()
+        if now - self.lastadjust < 1:
+           return
+        self.lastadjust = now
+        if self.latency > self.maxlatency:
+           self.rate = max(self.minrate,self.rate / 2)
+        else:
+           self.rate = min(self.maxrate,self.rate + self.maxrate / 10)
+
+    def progress(self,walker,force=False):
+        #-------------------------------------------------------
+        # Function: progress
+        # Desc: Output crawl progress if the progress interval has passed.
+        #       The estimated time remaining assumes sibling directories
+        #       are about the same size, so it firms up as the crawl goes.
+        # :walker: DirWalker being reported on
+        # :force: True=Output progress now
+        #-------------------------------------------------------
+        if self.progresssecs <= 0:
+           return
+        now = time.monotonic()
+        if now < self.nextprogress and not force:
+           return
+        self.nextprogress = now + self.progresssecs
+        elapsed = now - self.starttime
+        done = walker.done
+        eta = int(max(0.0,elapsed * (1 - done) / done)) if done > 0 else 0
+        print(f"progress|{time.strftime('%H:%M:%S')}|dirs={walker.dircount}|files={walker.filecount}"
+              f"|pct={done * 100:.1f}|ops/sec={self.ops / max(elapsed,0.001):.0f}|maxops={self.rate:.0f}"
+              f"|latencyms={self.latency * 1000:.3f}|eta={eta // 3600}:{eta % 3600 // 60:02d}:{eta % 60:02d}")
+
+class DirWalker:
+    #-------------------------------------------------------
+    # Class: DirWalker
+    # Desc: Directory walker used by all modes. Works like os.walk
+    #       top down without following symbolic links, but applies
+    #       the walk rules to each name before it is descended into or
+    #       stat'ed and returns the stat results with each file.
+    #       Each frontier entry carries the share of the whole tree it
+    #       is estimated to be, so progress is the sum of finished shares.
+    #       onenter is called with each directory path before it is listed.
+    #-------------------------------------------------------
+
+    def __init__(self,start_path,rules=None,start_depth=0,limiter=None,onenter=None):
+        self.rules = rules if rules is not None else WalkRules()
+        self.limiter = limiter
+        self.onenter = onenter
+        self.frontier = [(start_path,start_depth,1.0)]
+        self.done = 0.0
+        self.dircount = 0
+        self.filecount = 0
+
+    def setfrontier(self,frontier):
+        #-------------------------------------------------------
+        # Function: setfrontier
+        # Desc: Replace the frontier with one saved in a checkpoint
+        # :frontier: List of [directory path, depth, share] entries
+        #-------------------------------------------------------
+        self.frontier = [tuple(entry) for entry in frontier]
+        self.done = max(0.0,1.0 - sum(entry[2] for entry in self.frontier))
+
+    def walk(self):
+        #-------------------------------------------------------
+        # Function: walk
+        # Desc: Walk the directory tree
+        # :return: Generator of (directory path, depth, [(file name, stat result)])
+        #-------------------------------------------------------
+        rules = self.rules
+        limiter = self.limiter
+        while self.frontier:
+            dirpath, depth, share = self.frontier.pop()
+            files = []
+            subdirs = []
+            if self.onenter is not None:
+               self.onenter(dirpath)
+            try:
+               if limiter is not None:
+                  limiter.acquire()
+               with os.scandir(dirpath) as entries:
+                  for entry in entries:
+                      try:
+                         # skip if it is symbolic link
+                         if entry.is_symlink():
+                            continue
+                         if entry.is_dir(follow_symlinks=False):
+                            if rules.allowdir(dirpath,entry.name,depth + 1,entry):
+                               subdirs.append(entry.path)
+                         elif rules.allowfile(dirpath,entry.name):
+                            if limiter is not None:
+                               limiter.acquire()
+                               starttime = time.monotonic()
+                               st = entry.stat(follow_symlinks=False)
+                               limiter.observe(time.monotonic() - starttime)
+                            else:
+                               st = entry.stat(follow_symlinks=False)
+                            files.append((entry.name,st))
+                      except OSError:
+                         continue
+            except OSError:
+               self.done += share
+               continue
+            # Split this directory's share between itself and its subdirectories
+            share = share / (len(subdirs) + 1)
+            self.done += share
+            self.dircount += 1
+            self.filecount += len(files)
+            # Reverse so subdirectories are popped in listing order
+            self.frontier.extend((d,depth + 1,share) for d in reversed(subdirs))
+            if limiter is not None:
+               limiter.progress(self)
+            yield dirpath, depth, files
+        if limiter is not None:
+           limiter.progress(self,force=True)
+
+def getlibsize(lib_path,rules=None,max_ops=0):
+    #-------------------------------------------------------
+    # Function: getlibsize
+    # Desc: Size a single library broken down by object type. Runs in a
+    #       pool worker process, so it gets its own rate limiter.
+    # :lib_path: Library path. Ex: /QSYS.LIB/QGPL.LIB
+    # :rules: WalkRules to apply. Default=No rules
+    # :max_ops: Directory reads and stats per second. 0=No limit
+    # :return: Tuple of (library path, {object type: [object count, total size]},
+    #          [member count, member size]). Member sizes are included in the .FILE total.
+    #-------------------------------------------------------
+    limiter = IoRateLimiter(max_ops) if max_ops > 0 else None
+    totals = {}
+    members = [0,0]
+    for dirpath, depth, files in DirWalker(lib_path,rules,1,limiter).walk():
+        # Database files are directories of .MBR members. Their size
+        # belongs to the owning .FILE object.
+        infile = os.path.splitext(dirpath)[1].upper() == ".FILE"
+        if infile:
+           totals.setdefault(".FILE",[0,0])[0] += 1
+        for f, st in files:
+            if infile:
+               totals[".FILE"][1] += st.st_size
+               members[0] += 1
+               members[1] += st.st_size
+               continue
+            objtype = os.path.splitext(f)[1].upper() or "(none)"
+            objtotal = totals.setdefault(objtype,[0,0])
+            objtotal[0] += 1
+            objtotal[1] += st.st_size
+    return lib_path, totals, members
+
+def getalllibsizes(qsys_path='/QSYS.LIB',workers=4,rules=None,max_ops=0):
+    #-------------------------------------------------------
+    # Function: getalllibsizes
+    # Desc: Size every *.LIB directory in the QSYS.LIB directory in
+    #       parallel on a process pool. Worker processes are forked so
+    #       the script isn't re-run in each worker. Threads are used if
+    #       fork is not available.
+    # :qsys_path: QSYS.LIB directory path
+    # :workers: Number of worker processes
+    # :rules: WalkRules to apply. Default=No rules
+    # :max_ops: Directory reads and stats per second shared by all workers. 0=No limit
+    # :return: List of (library name, total size, {object type: [object count, total size]},
+    #          [member count, member size]) sorted largest library first
+    #-------------------------------------------------------
+    rules = rules if rules is not None else WalkRules()
+    libs = sorted(entry.path for entry in os.scandir(qsys_path)
+                  if entry.is_dir(follow_symlinks=False) and entry.name.upper().endswith(".LIB")
+                  and rules.allowdir(qsys_path,entry.name,1,entry))
+    if "fork" in multiprocessing.get_all_start_methods():
+       pool = ProcessPoolExecutor(max_workers=workers,mp_context=multiprocessing.get_context("fork"))
+    else:
+       pool = ThreadPoolExecutor(max_workers=workers)
+    with pool:
+       results = list(pool.map(getlibsize,libs,[rules] * len(libs),[max_ops / workers] * len(libs)))
+
+    libsizes = []
+    for lib_path, totals, members in results:
+        libname = os.path.splitext(os.path.basename(lib_path))[0]
+        libsizes.append((libname,sum(t[1] for t in totals.values()),totals,members))
+    libsizes.sort(key=lambda l: l[1],reverse=True)
+    return libsizes
+
+class HashingFile:
+    #-------------------------------------------------------
+    # Class: HashingFile
+    # Desc: Binary file wrapper that checksums and counts the bytes
+    #       written, so a chunk's checksum is known when it is closed
+    #       without reading it back.
+    #-------------------------------------------------------
+
+    def __init__(self,f):
+        self.f = f
+        self.sha = hashlib.sha256()
+        self.size = 0
+
+    def write(self,data):
+        self.sha.update(data)
+        self.size += len(data)
+        return self.f.write(data)
+
+    def flush(self):
+        self.f.flush()
+
+class CrawlExporter:
+    #-------------------------------------------------------
+    # Class: CrawlExporter
+    # Desc: Stream crawl records into size rotated csv or jsonl chunk
+    #       files with an optional gzip layer. A chunk is written as
+    #       name.part and renamed when complete, then the manifest is
+    #       rewritten, so a loader can pick up finished chunks while
+    #       the crawl is still running. Only one chunk is open at a time.
+    #       oncommit is called once a chunk is on disk but before it gets
+    #       its final name, so a checkpoint never lags the chunks a loader
+    #       can see.
+    #-------------------------------------------------------
+
+    COLUMNS = ["ifspath", "ifsdir", "ifsname", "ifssize", "ifsmodified", "ifsaccessed", "ifschanged"]
+
+    def __init__(self,export_dir,export_format="csv",compress=True,chunk_bytes=104857600,prefix="dircrawl"):
+        if export_format not in ("csv","jsonl"):
+           raise Exception(f"Export format {export_format} is not csv or jsonl. Process cancelled.")
+        os.makedirs(export_dir,exist_ok=True)
+        self.exportdir = export_dir
+        self.format = export_format
+        self.compress = compress
+        self.chunkbytes = chunk_bytes
+        self.prefix = prefix
+        self.chunks = []
+        self.rows = 0
+        self.chunkrows = 0
+        self.chunkwritten = 0
+        self.raw = None
+        self.buf = io.StringIO()
+        self.csvwriter = csv.writer(self.buf,lineterminator="\n")
+        self.oncommit = None
+
+    def chunkname(self):
+        ext = "." + self.format + (".gz" if self.compress else "")
+        return f"{self.prefix}_{len(self.chunks) + 1:05d}{ext}"
+
+    def openchunk(self):
+        self.rawfile = open(os.path.join(self.exportdir,self.chunkname() + ".part"),"wb")
+        self.raw = HashingFile(self.rawfile)
+        self.out = gzip.GzipFile(filename="",mode="wb",fileobj=self.raw) if self.compress else self.raw
+        self.chunkrows = 0
+        self.chunkwritten = 0
+        if self.format == "csv":
+           self.out.write((",".join(self.COLUMNS) + "\n").encode())
+
+    def closechunk(self):
+        if self.raw is None:
+           return
+        self.flushbuffer()
+        if self.compress:
+           self.out.close()
+        self.rawfile.flush()
+        os.fsync(self.rawfile.fileno())
+        self.rawfile.close()
+        name = self.chunkname()
+        self.chunks.append({"file": name, "rows": self.chunkrows, "bytes": self.raw.size,
+                            "sha256": self.raw.sha.hexdigest()})
+        self.raw = None
+        if self.oncommit is not None:
+           self.oncommit()
+        os.replace(os.path.join(self.exportdir,name + ".part"),os.path.join(self.exportdir,name))
+        self.writemanifest("running")
+
+    def resume(self,chunks,rows):
+        #-------------------------------------------------------
+        # Function: resume
+        # Desc: Continue an export after the chunks saved in a checkpoint.
+        #       A chunk that was checkpointed but not yet renamed when the
+        #       job ended is renamed now.
+        # :chunks: Chunk list saved in the checkpoint
+        # :rows: Row count saved in the checkpoint
+        #-------------------------------------------------------
+        for chunk in chunks:
+            chunkfile = os.path.join(self.exportdir,chunk["file"])
+            if not os.path.isfile(chunkfile):
+               os.replace(chunkfile + ".part",chunkfile)
+        self.chunks = list(chunks)
+        self.rows = rows
+        self.writemanifest("running")
+
+    def flushbuffer(self):
+        data = self.buf.getvalue().encode("utf-8","replace")
+        if data:
+           self.out.write(data)
+           self.chunkwritten += len(data)
+        self.buf.seek(0)
+        self.buf.truncate()
+
+    def addrow(self,row):
+        #-------------------------------------------------------
+        # Function: addrow
+        # Desc: Add a crawl record. Records are buffered in 64K blocks and
+        #       the chunk is rotated once it reaches the chunk size, counting
+        #       records still in the buffer.
+        # :row: Tuple of values in COLUMNS order
+        #-------------------------------------------------------
+        if self.raw is None:
+           self.openchunk()
+        if self.format == "csv":
+           self.csvwriter.writerow(row)
+        else:
+           self.buf.write(json.dumps(dict(zip(self.COLUMNS,row))) + "\n")
+        self.rows += 1
+        self.chunkrows += 1
+        if self.buf.tell() >= 65536:
+           self.flushbuffer()
+        if self.chunkwritten + self.buf.tell() >= self.chunkbytes:
+           self.closechunk()
+
+    def writemanifest(self,status):
+        manifest = {"status": status, "format": self.format, "compressed": self.compress,
+                    "columns": self.COLUMNS, "header": self.format == "csv",
+                    "rows": sum(c["rows"] for c in self.chunks), "chunks": self.chunks}
+        manifestfile = os.path.join(self.exportdir,"manifest.json")
+        with open(manifestfile + ".tmp","w") as f:
+           json.dump(manifest,f,indent=1)
+        os.replace(manifestfile + ".tmp",manifestfile)
+
+    def close(self):
+        #-------------------------------------------------------
+        # Function: close
+        # Desc: Finish the last chunk and mark the manifest complete
+        #-------------------------------------------------------
+        self.closechunk()
+        self.writemanifest("complete")
+
+def exportdircrawl(start_path,exporter,rules=None,limiter=None,checkpoint_file=None,resume=False):
+    #-------------------------------------------------------
+    # Function: exportdircrawl
+    # Desc: Crawl directory and stream a record for each file to the exporter
+    # :start_path: Directory to crawl
+    # :exporter: CrawlExporter to write records to
+    # :rules: WalkRules to apply. Default=No rules
+    # :limiter: IoRateLimiter to pace the crawl. Default=No limit
+    # :checkpoint_file: Save the crawl position to this file each time a
+    #                   chunk is committed. Default=No checkpoints
+    # :resume: Continue after the last chunk saved in checkpoint_file
+    # :return: Total size of directory contents
+    #-------------------------------------------------------
+    def fmttime(t):
+        # DB2 for i timestamp format
+        return time.strftime("%Y-%m-%d-%H.%M.%S.000000",time.localtime(t))
+
+    # Files are exported in name order, so a chunk committed part way through
+    # a directory can be resumed after the last file name it holds
+    position = {"totalsize": 0}
+    walker = DirWalker(start_path,rules,limiter=limiter)
+
+    def exportfiles(dirpath,depth,files,after=None):
+        for f, st in sorted(files,key=lambda e: e[0]):
+            if after is not None and f <= after:
+               continue
+            position.update(totalsize=position["totalsize"] + st.st_size,dirpath=dirpath,depth=depth,name=f)
+            exporter.addrow((os.path.join(dirpath,f),dirpath,f,st.st_size,
+                             fmttime(st.st_mtime),fmttime(st.st_atime),fmttime(st.st_ctime)))
+
+    def oncommit():
+        savecheckpoint(checkpoint_file,{"dirname": start_path,
+                                        "savetime": time.strftime("%Y-%m-%d %H:%M:%S"),
+                                        "totalsize": position["totalsize"],
+                                        "frontier": walker.frontier,
+                                        "partialdir": position.get("dirpath"),
+                                        "partialdepth": position.get("depth"),
+                                        "lastname": position.get("name"),
+                                        "format": exporter.format,
+                                        "compressed": exporter.compress,
+                                        "chunks": exporter.chunks,
+                                        "rows": exporter.rows})
+
+    if checkpoint_file:
+       exporter.oncommit = oncommit
+    state = loadcheckpoint(checkpoint_file,start_path) if (checkpoint_file and resume) else None
+    if state is not None:
+       if state["format"] != exporter.format or state["compressed"] != exporter.compress:
+          raise Exception(f"Checkpoint {checkpoint_file} is for a different export format or compression. Process cancelled.")
+       exporter.resume(state["chunks"],state["rows"])
+       walker.setfrontier(state["frontier"])
+       position["totalsize"] = state["totalsize"]
+       print(f"Resuming from checkpoint {checkpoint_file} saved {state['savetime']} with {state['rows']} rows in {len(state['chunks'])} chunks and {len(walker.frontier)} directories remaining")
+       # Finish the directory the last committed chunk ended in. Its
+       # subdirectories are already in the saved frontier.
+       if state["partialdir"] is not None:
+          for dirpath, depth, files in DirWalker(state["partialdir"],rules,state["partialdepth"],limiter).walk():
+              exportfiles(dirpath,depth,files,state["lastname"])
+              break
+
+    for dirpath, depth, files in walker.walk():
+        exportfiles(dirpath,depth,files)
+    exporter.close()
+
+    # Export is complete so the checkpoint is no longer needed
+    if checkpoint_file and os.path.isfile(checkpoint_file):
+       os.remove(checkpoint_file)
+    return position["totalsize"]
+
+def savecheckpoint(checkpoint_file,state):
+    #-------------------------------------------------------
+    # Function: savecheckpoint
+    # Desc: Atomically save crawl state. The state is written to a
+    #       temporary file which then replaces the checkpoint file, so
+    #       a job ended mid write never leaves a partial checkpoint.
+    # :checkpoint_file: Checkpoint file path
+    # :state: Dictionary of JSON serializable crawl state
+    #-------------------------------------------------------
+    tmpfile = checkpoint_file + ".tmp"
+    with open(tmpfile,"w") as f:
+       json.dump(state,f)
+       f.flush()
+       os.fsync(f.fileno())
+    os.replace(tmpfile,checkpoint_file)
+
+def loadcheckpoint(checkpoint_file,start_path):
+    #-------------------------------------------------------
+    # Function: loadcheckpoint
+    # Desc: Load crawl state saved by savecheckpoint
+    # :checkpoint_file: Checkpoint file path
+    # :start_path: Directory being crawled. Must match the checkpoint.
+    # :return: Dictionary of crawl state or None if there is no checkpoint
+    #-------------------------------------------------------
+    if not os.path.isfile(checkpoint_file):
+       return None
+    with open(checkpoint_file,"r") as f:
+       state = json.load(f)
+    if state.get("dirname") != start_path:
+       raise Exception(f"Checkpoint {checkpoint_file} is for {state.get('dirname')} not {start_path}. Process cancelled.")
+    return state
+
+def getdirsize(start_path = '.',list_files=False,rules=None,checkpoint_file=None,checkpoint_secs=5,resume=False,limiter=None):
     #-------------------------------------------------------
     # Function: getdirsize
     # Desc: Crawl directory and return size of all files and objects
+    # :rules: WalkRules to apply. Default=No rules
+    # :checkpoint_file: Save the remaining directories and totals to this
+    #                   file every checkpoint_secs. Default=No checkpoints
+    # :checkpoint_secs: Seconds between checkpoint saves
+    # :resume: Continue from the state saved in checkpoint_file
+    # :limiter: IoRateLimiter to pace the crawl. Default=No limit
     # :return: Total size of directory contents
     #-------------------------------------------------------
     total_size = 0
     firstrecord=True
-    for dirpath, dirnames, filenames in os.walk(start_path):
-        for f in filenames:
+    walker = DirWalker(start_path,rules,limiter=limiter)
+
+    # Pick up where the last checkpoint left off. The checkpoint is only
+    # saved between directories, so the totals match the remaining frontier.
+    state = loadcheckpoint(checkpoint_file,start_path) if (checkpoint_file and resume) else None
+    if state is not None:
+       walker.setfrontier(state["frontier"])
+       total_size = state["totalsize"]
+       print(f"Resuming from checkpoint {checkpoint_file} saved {state['savetime']} with {total_size} bytes and {len(walker.frontier)} directories remaining")
+
+    nextcheckpoint = time.time() + checkpoint_secs
+    for dirpath, depth, files in walker.walk():
+        # Save progress every few seconds once this directory is counted
+        if checkpoint_file and time.time() >= nextcheckpoint:
+           nextcheckpoint = time.time() + checkpoint_secs
+           checkpointpending = True
+        else:
+           checkpointpending = False
+        for f, st in files:
             fp = os.path.join(dirpath, f)
-            # skip if it is symbolic link
-            if not os.path.islink(fp):
-                file_size = os.path.getsize(fp)
-                total_size += file_size
-                # List file names and size info to console if enabled
-                if (list_files):
-                   
-                   # Write headings on first record
-                   if (firstrecord):
-                      print(f"filepath|filesize|totalsize")
-                      firstrecord=False
-                      
-                   # Write out file path and size   
-                   print(f"{fp}|{file_size}|{total_size}")
+            file_size = st.st_size
+            total_size += file_size
+            # List file names and size info to console if enabled
+            if (list_files):
+               
+               # Write headings on first record
+               if (firstrecord):
+                  print(f"filepath|filesize|totalsize")
+                  firstrecord=False
+                  
+               # Write out file path and size   
+               print(f"{fp}|{file_size}|{total_size}")
+
+        if checkpointpending:
+           savecheckpoint(checkpoint_file,{"dirname": start_path,
+                                           "savetime": time.strftime("%Y-%m-%d %H:%M:%S"),
+                                           "totalsize": total_size,
+                                           "frontier": walker.frontier})
+
+    # Crawl is complete so the checkpoint is no longer needed
+    if checkpoint_file and os.path.isfile(checkpoint_file):
+       os.remove(checkpoint_file)
 
     return total_size
 
+def getfilehashpartial(filepath,file_size,block_size=4096):
+    #-------------------------------------------------------
+    # Function: getfilehashpartial
+    # Desc: Hash the first and last block of a file. Files that fit
+    #       in two blocks are read completely, so the partial hash is
+    #       also the full content hash for those files.
+    # :filepath: File path to hash
+    # :file_size: File size in bytes
+    # :block_size: Bytes to read from the start and end of the file
+    # :return: Hex digest or None if the file could not be read
+    #-------------------------------------------------------
+    try:
+       h = hashlib.blake2b()
+       with open(filepath,"rb") as f:
+          h.update(f.read(block_size))
+          if (file_size > block_size * 2):
+             f.seek(file_size - block_size)
+          h.update(f.read(block_size))
+       return h.hexdigest()
+    except OSError:
+       return None
+
+def getfilehashfull(filepath,chunk_size=1048576):
+    #-------------------------------------------------------
+    # Function: getfilehashfull
+    # Desc: Hash the full file contents using a memory-mapped read.
+    #       Falls back to chunked reads if the object can't be mapped.
+    # :filepath: File path to hash
+    # :chunk_size: Bytes to hash per update
+    # :return: Hex digest or None if the file could not be read
+    #-------------------------------------------------------
+    try:
+       h = hashlib.blake2b()
+       with open(filepath,"rb") as f:
+          try:
+             with mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ) as m:
+                for offset in range(0,len(m),chunk_size):
+                   h.update(m[offset:offset + chunk_size])
+          except (ValueError,OSError):
+             f.seek(0)
+             for chunk in iter(lambda: f.read(chunk_size),b""):
+                h.update(chunk)
+       return h.hexdigest()
+    except OSError:
+       return None
+
+def hashcandidates(groups,hashfunc,workers):
+    #-------------------------------------------------------
+    # Function: hashcandidates
+    # Desc: Hash every file in each candidate group on a worker pool
+    #       and split the groups by digest. Groups with a single
+    #       member left are dropped since they can't be duplicates.
+    # :groups: List of (file size, [file paths]) candidate groups
+    # :hashfunc: Function taking (file path, file size) and returning a digest
+    # :workers: Number of worker threads
+    # :return: List of (file size, [file paths]) groups with matching digests
+    #-------------------------------------------------------
+    jobs = [(size,fp) for size, paths in groups for fp in paths]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+       digests = list(pool.map(lambda job: hashfunc(job[1],job[0]),jobs))
+
+    buckets = {}
+    for (size,fp), digest in zip(jobs,digests):
+       if digest is not None:
+          buckets.setdefault((size,digest),[]).append(fp)
+
+    return [(size,paths) for (size,digest), paths in buckets.items() if len(paths) > 1]
+
+def finddupfiles(start_path = '.',workers=4,block_size=4096,rules=None,limiter=None):
+    #-------------------------------------------------------
+    # Function: finddupfiles
+    # Desc: Crawl directory and locate duplicate files in stages.
+    #       1) Bucket files by size. Unique sizes are never read.
+    #       2) Hash the first and last block of same sized files.
+    #       3) Fully hash the remaining candidates with mmap reads.
+    #       Hard links to the same file are only counted once and
+    #       empty files are skipped since they waste no space.
+    # :start_path: Directory to crawl
+    # :workers: Number of worker threads used for hashing
+    # :block_size: Block size used for the partial hash
+    # :rules: WalkRules to apply. Default=No rules
+    # :limiter: IoRateLimiter to pace the crawl. Default=No limit
+    # :return: List of (file size, [file paths]) duplicate groups
+    #-------------------------------------------------------
+    sizes = {}
+    inodes = set()
+    for dirpath, depth, files in DirWalker(start_path,rules,limiter=limiter).walk():
+        for f, st in files:
+            fp = os.path.join(dirpath, f)
+            # skip empty files and extra hard links
+            if (st.st_size == 0):
+               continue
+            if ((st.st_dev,st.st_ino) in inodes):
+               continue
+            inodes.add((st.st_dev,st.st_ino))
+            sizes.setdefault(st.st_size,[]).append(fp)
+
+    # Stage 1 - only sizes with more than one file are candidates
+    groups = [(size,paths) for size, paths in sizes.items() if len(paths) > 1]
+
+    # Stage 2 - partial hash of first and last block
+    groups = hashcandidates(groups,lambda fp,size: getfilehashpartial(fp,size,block_size),workers)
+
+    # Stage 3 - full hash only where the partial hash didn't read the whole file
+    small = [(size,paths) for size, paths in groups if size <= block_size * 2]
+    large = [(size,paths) for size, paths in groups if size > block_size * 2]
+    groups = small + hashcandidates(large,lambda fp,size: getfilehashfull(fp),workers)
+
+    # Largest reclaimable space first
+    groups.sort(key=lambda g: g[0] * (len(g[1]) - 1),reverse=True)
+    return groups
+
+def getdirstats(start_path = '.',rules=None,limiter=None):
+    #-------------------------------------------------------
+    # Function: getdirstats
+    # Desc: Crawl directory and collect stat results into compact typed
+    #       arrays. Top level directory and extension names are stored
+    #       once and referenced by index, so each file costs 24 bytes.
+    # :start_path: Directory to crawl
+    # :rules: WalkRules to apply. Default=No rules
+    # :limiter: IoRateLimiter to pace the crawl. Default=No limit
+    # :return: Dictionary with size, mtime, top and ext arrays plus the
+    #          topnames and extnames lists the indexes refer to
+    #-------------------------------------------------------
+    stats = {"size": array('q'), "mtime": array('q'),
+             "top": array('i'), "ext": array('i'),
+             "topnames": [], "extnames": []}
+    topindex = {}
+    extindex = {}
+    for dirpath, depth, files in DirWalker(start_path,rules,limiter=limiter).walk():
+        # Top level directory below the start path. Files in the start path itself are grouped as .
+        top = os.path.relpath(dirpath, start_path).split(os.sep)[0]
+        if top not in topindex:
+           topindex[top] = len(stats["topnames"])
+           stats["topnames"].append(top)
+        topidx = topindex[top]
+        for f, st in files:
+            ext = os.path.splitext(f)[1].lower()
+            if ext not in extindex:
+               extindex[ext] = len(stats["extnames"])
+               stats["extnames"].append(ext)
+            stats["size"].append(st.st_size)
+            stats["mtime"].append(int(st.st_mtime))
+            stats["top"].append(topidx)
+            stats["ext"].append(extindex[ext])
+
+    return stats
+
+def bucketize(values,bounds):
+    #-------------------------------------------------------
+    # Function: bucketize
+    # Desc: Map each value to the index of the first bucket bound it is below.
+    #       Values at or above the last bound land in bucket len(bounds).
+    # :values: numpy array or array module values
+    # :bounds: Sorted list of bucket upper bounds
+    # :return: Bucket index for each value
+    #-------------------------------------------------------
+    if numpy is not None:
+       return numpy.searchsorted(numpy.asarray(bounds),values,side="right")
+    return array('i',(bisect.bisect_right(bounds,v) for v in values))
+
+def groupsum(keys,weights,nkeys):
+    #-------------------------------------------------------
+    # Function: groupsum
+    # Desc: Count and sum weights by integer key in a single pass
+    # :keys: Integer key for each record
+    # :weights: Weight for each record
+    # :nkeys: Number of distinct keys
+    # :return: Tuple of (counts list, sums list) indexed by key
+    #-------------------------------------------------------
+    if numpy is not None:
+       counts = numpy.bincount(keys,minlength=nkeys)
+       sums = numpy.bincount(keys,weights=weights,minlength=nkeys)
+       return [int(c) for c in counts], [int(v) for v in sums]
+    counts = [0] * nkeys
+    sums = [0] * nkeys
+    for k, w in zip(keys,weights):
+       counts[k] += 1
+       sums[k] += w
+    return counts, sums
+
+def getdiranalytics(stats,older_days=365,now=None):
+    #-------------------------------------------------------
+    # Function: getdiranalytics
+    # Desc: Compute histograms and group-by totals from the stat arrays
+    # :stats: Dictionary returned by getdirstats
+    # :older_days: Age in days used for the bytes older than totals
+    # :now: Reference time in epoch seconds. Default=current time
+    # :return: Dictionary of result tables. Each table is a list of
+    #          (label, file count, total size) tuples except bytopdir
+    #          which also includes the file count and size older than older_days
+    #-------------------------------------------------------
+    if now is None:
+       now = time.time()
+    sizes = stats["size"]
+    mtimes = stats["mtime"]
+    tops = stats["top"]
+    exts = stats["ext"]
+
+    # Wrap the arrays without copying when numpy is available
+    if numpy is not None:
+       sizes = numpy.frombuffer(sizes,dtype=numpy.int64) if len(sizes) else numpy.zeros(0,numpy.int64)
+       mtimes = numpy.frombuffer(mtimes,dtype=numpy.int64) if len(mtimes) else numpy.zeros(0,numpy.int64)
+       tops = numpy.frombuffer(tops,dtype=numpy.int32) if len(tops) else numpy.zeros(0,numpy.int32)
+       exts = numpy.frombuffer(exts,dtype=numpy.int32) if len(exts) else numpy.zeros(0,numpy.int32)
+       ages = (now - mtimes) / 86400.0
+    else:
+       ages = array('d',((now - m) / 86400.0 for m in mtimes))
+
+    def labels(bounds,unit):
+       lows = [0] + bounds
+       names = [f"{lows[i]}-{bounds[i]}{unit}" for i in range(len(bounds))]
+       return names + [f">={bounds[-1]}{unit}"]
+
+    results = {}
+
+    counts, sums = groupsum(bucketize(ages,AGE_BUCKETS),sizes,len(AGE_BUCKETS) + 1)
+    results["byage"] = list(zip(labels(AGE_BUCKETS,"d"),counts,sums))
+
+    counts, sums = groupsum(bucketize(sizes,SIZE_BUCKETS),sizes,len(SIZE_BUCKETS) + 1)
+    results["bysize"] = list(zip(labels(SIZE_BUCKETS,"b"),counts,sums))
+
+    counts, sums = groupsum(exts,sizes,len(stats["extnames"]))
+    results["byext"] = sorted(zip(stats["extnames"],counts,sums),key=lambda r: r[2],reverse=True)
+
+    # Split each top level directory key into current and old halves
+    ntop = len(stats["topnames"])
+    if numpy is not None:
+       keys = tops + (ages >= older_days) * ntop
+    else:
+       keys = array('i',(t + (a >= older_days) * ntop for t, a in zip(tops,ages)))
+    counts, sums = groupsum(keys,sizes,ntop * 2)
+    results["bytopdir"] = sorted(((stats["topnames"][i],counts[i] + counts[i + ntop],sums[i] + sums[i + ntop],
+                                   counts[i + ntop],sums[i + ntop]) for i in range(ntop)),
+                                 key=lambda r: r[2],reverse=True)
+
+    return results
+
+class DirSizeTracker:
+    #-------------------------------------------------------
+    # Class: DirSizeTracker
+    # Desc: Keep file sizes and per directory totals for a directory
+    #       tree in memory so they can be updated one path at a time
+    #       as change notifications arrive instead of rescanning.
+    #-------------------------------------------------------
+
+    def __init__(self,start_path,rules=None):
+        self.start_path = os.path.abspath(start_path)
+        self.rules = rules if rules is not None else WalkRules()
+        self.dirs = {}       # directory path -> {file name: file size}
+        self.dirtotals = {}  # directory path -> bytes of files directly in the directory
+        self.dirmtimes = {}  # directory path -> mtime, used when polling
+        self.children = {}   # directory path -> set of tracked subdirectory paths
+        self.total = 0
+
+    def scan(self,dirpath,onenter=None):
+        #-------------------------------------------------------
+        # Function: scan
+        # Desc: Add a directory and all subdirectories to the totals.
+        #       Anything already tracked under the directory is dropped
+        #       first, so a rescan never counts a file twice.
+        # :dirpath: Directory path to scan
+        # :onenter: Called with each directory path before it is listed. Default=None
+        # :return: List of directory paths that were added
+        #-------------------------------------------------------
+        if dirpath in self.dirs:
+           self.removedir(dirpath)
+        added = []
+        for walkpath, depth, files in DirWalker(dirpath,self.rules,self.depth(dirpath),onenter=onenter).walk():
+            self.dirs[walkpath] = {}
+            self.children[walkpath] = set()
+            if walkpath != self.start_path:
+               self.children.setdefault(os.path.dirname(walkpath),set()).add(walkpath)
+            self.dirtotals[walkpath] = 0
+            try:
+               self.dirmtimes[walkpath] = os.stat(walkpath).st_mtime
+            except OSError:
+               self.dirmtimes[walkpath] = 0
+            for f, st in files:
+                self.dirs[walkpath][f] = st.st_size
+                self.dirtotals[walkpath] += st.st_size
+                self.total += st.st_size
+            added.append(walkpath)
+        return added
+
+    def depth(self,dirpath):
+        #-------------------------------------------------------
+        # Function: depth
+        # Desc: Get the depth of a directory below the start directory
+        # :dirpath: Directory path
+        # :return: Depth. 0=Start directory
+        #-------------------------------------------------------
+        relpath = os.path.relpath(dirpath,self.start_path)
+        return 0 if relpath == "." else len(relpath.split(os.sep))
+
+    def allowdir(self,dirpath):
+        #-------------------------------------------------------
+        # Function: allowdir
+        # Desc: Check a new directory against the walk rules
+        # :dirpath: Directory path
+        # :return: True=Track directory, False=Skip directory
+        #-------------------------------------------------------
+        parent, name = os.path.split(dirpath)
+        return self.rules.allowdir(parent,name,self.depth(dirpath))
+
+    def updatefile(self,dirpath,name):
+        #-------------------------------------------------------
+        # Function: updatefile
+        # Desc: Re-stat a single file and apply the size change. A file
+        #       that no longer exists is removed from the totals.
+        # :dirpath: Directory path containing the file
+        # :name: File name
+        # :return: Size change in bytes
+        #-------------------------------------------------------
+        files = self.dirs.get(dirpath)
+        if files is None:
+           return 0
+        newsize = None
+        if self.rules.allowfile(dirpath,name):
+           try:
+              st = os.lstat(os.path.join(dirpath,name))
+              # skip symbolic links and directories
+              if stat.S_ISREG(st.st_mode):
+                 newsize = st.st_size
+           except OSError:
+              pass
+        oldsize = files.pop(name,0)
+        if newsize is not None:
+           files[name] = newsize
+        delta = (newsize or 0) - oldsize
+        self.dirtotals[dirpath] += delta
+        self.total += delta
+        return delta
+
+    def removedir(self,dirpath,recursive=True):
+        #-------------------------------------------------------
+        # Function: removedir
+        # Desc: Remove a directory and optionally its subdirectories from the totals.
+        #       Subdirectories are found through the children index, so the
+        #       cost follows the size of the removed subtree only.
+        # :dirpath: Directory path to remove
+        # :recursive: True=Also remove subdirectories
+        # :return: List of directory paths that were removed
+        #-------------------------------------------------------
+        removed = []
+        pending = [dirpath]
+        while pending:
+            d = pending.pop()
+            if self.dirs.pop(d,None) is None:
+               continue
+            self.total -= self.dirtotals.pop(d)
+            self.dirmtimes.pop(d,None)
+            subdirs = self.children.pop(d,set())
+            if recursive:
+               pending.extend(subdirs)
+            removed.append(d)
+        siblings = self.children.get(os.path.dirname(dirpath))
+        if siblings is not None:
+           siblings.discard(dirpath)
+        return removed
+
+    def poll(self):
+        #-------------------------------------------------------
+        # Function: poll
+        # Desc: Polling fallback when change notifications are not available.
+        #       Directories are only relisted when their mtime changed, but
+        #       every known file is re-stat'ed to catch files growing in place.
+        #-------------------------------------------------------
+        for dirpath in list(self.dirs):
+            if dirpath not in self.dirs:
+               continue
+            try:
+               mtime = os.stat(dirpath).st_mtime
+            except OSError:
+               self.removedir(dirpath)
+               continue
+            if mtime != self.dirmtimes.get(dirpath):
+               self.dirmtimes[dirpath] = mtime
+               try:
+                  entries = list(os.scandir(dirpath))
+               except OSError:
+                  continue
+               names = set()
+               for entry in entries:
+                   if entry.is_dir(follow_symlinks=False):
+                      if entry.path not in self.dirs and self.allowdir(entry.path):
+                         self.scan(entry.path)
+                   else:
+                      names.add(entry.name)
+               for name in names | set(self.dirs[dirpath]):
+                   self.updatefile(dirpath,name)
+               continue
+            for name in list(self.dirs[dirpath]):
+                self.updatefile(dirpath,name)
+
+    def report(self):
+        #-------------------------------------------------------
+        # Function: report
+        # Desc: Output the total and the totals of each top level directory
+        #-------------------------------------------------------
+        tops = {}
+        for dirpath, size in self.dirtotals.items():
+            top = os.path.relpath(dirpath,self.start_path).split(os.sep)[0]
+            tops[top] = tops.get(top,0) + size
+        print(f"watchtime|topdir|totalsize")
+        for top, size in sorted(tops.items(),key=lambda t: t[1],reverse=True):
+            print(f"{time.strftime('%H:%M:%S')}|{top}|{size}")
+        print(f"Total Size: {self.total} bytes")
+
+class InotifyWatch:
+    #-------------------------------------------------------
+    # Class: InotifyWatch
+    # Desc: Minimal ctypes wrapper over the Linux inotify API.
+    #       Raises OSError if inotify is not available on this system.
+    #-------------------------------------------------------
+
+    def __init__(self):
+        libname = ctypes.util.find_library("c")
+        self.libc = ctypes.CDLL(libname,use_errno=True)
+        if not hasattr(self.libc,"inotify_init"):
+           raise OSError("inotify is not available")
+        self.fd = self.libc.inotify_init()
+        if self.fd < 0:
+           raise OSError(ctypes.get_errno(),"inotify_init failed")
+        self.paths = {}  # watch descriptor -> directory path
+        self.wds = {}    # directory path -> watch descriptor
+
+    def addwatch(self,dirpath):
+        #-------------------------------------------------------
+        # Function: addwatch
+        # Desc: Watch a directory for changes. Raises OSError if the watch
+        #       can't be added, such as ENOSPC once fs.inotify.max_user_watches
+        #       is reached. A directory that vanished first is not an error.
+        # :dirpath: Directory path to watch
+        #-------------------------------------------------------
+        wd = self.libc.inotify_add_watch(self.fd,os.fsencode(dirpath),IN_WATCH_MASK)
+        if wd < 0:
+           err = ctypes.get_errno()
+           if err in (errno.ENOENT,errno.ENOTDIR):
+              return
+           raise OSError(err,f"inotify_add_watch failed for {dirpath}: {os.strerror(err)}")
+        self.paths[wd] = dirpath
+        self.wds[dirpath] = wd
+
+    def rmwatch(self,dirpath):
+        wd = self.wds.pop(dirpath,None)
+        if wd is not None and self.paths.get(wd) == dirpath:
+           del self.paths[wd]
+           self.libc.inotify_rm_watch(self.fd,wd)
+
+    def read(self,timeout):
+        #-------------------------------------------------------
+        # Function: read
+        # Desc: Wait for change events
+        # :timeout: Seconds to wait
+        # :return: List of (directory path, name, mask) events
+        #-------------------------------------------------------
+        events = []
+        try:
+           ready, _, _ = select.select([self.fd],[],[],timeout)
+        except InterruptedError:
+           return events
+        if not ready:
+           return events
+        buf = os.read(self.fd,65536)
+        offset = 0
+        while offset < len(buf):
+            wd, mask, cookie, length = struct.unpack_from("iIII",buf,offset)
+            name = buf[offset + 16:offset + 16 + length].rstrip(b"\0")
+            offset += 16 + length
+            events.append((self.paths.get(wd),os.fsdecode(name),mask))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+def watchdirsize(start_path = '.',interval=60,threshold=0,duration=0,rules=None):
+    #-------------------------------------------------------
+    # Function: watchdirsize
+    # Desc: Scan the directory once and then keep the totals current
+    #       from change notifications. Totals are reported every
+    #       interval seconds, on SIGUSR1 and on threshold crossings.
+    # :start_path: Directory to watch
+    # :interval: Report interval in seconds. Also the poll interval when polling.
+    # :threshold: Total size threshold in bytes. 0=No threshold
+    # :duration: Seconds to run. 0=Run until the job is ended
+    # :rules: WalkRules to apply. Default=No rules
+    # :return: Final total size of directory contents
+    #-------------------------------------------------------
+    tracker = DirSizeTracker(start_path,rules)
+    state = {"report": False, "stop": False}
+
+    def onreport(signum,frame):
+        state["report"] = True
+
+    def onstop(signum,frame):
+        state["stop"] = True
+
+    if hasattr(signal,"SIGUSR1"):
+       signal.signal(signal.SIGUSR1,onreport)
+    signal.signal(signal.SIGTERM,onstop)
+
+    try:
+       watcher = InotifyWatch()
+       print("Watch method: inotify")
+    except (OSError,AttributeError):
+       watcher = None
+       print("Watch method: polling")
+
+    def addwatch(dirpath):
+        # Watch each directory before it is listed, so a change made while
+        # it is being scanned still produces an event. If a directory can't
+        # be watched the tree switches to polling, so none silently goes stale.
+        nonlocal watcher
+        if watcher is None:
+           return
+        try:
+           watcher.addwatch(dirpath)
+        except OSError as ex:
+           print(f"Warning: {ex}. Switching to polling so all directories stay current.")
+           watcher.close()
+           watcher = None
+
+    def fullscan():
+        for dirpath in tracker.removedir(tracker.start_path):
+            if watcher is not None:
+               watcher.rmwatch(dirpath)
+        tracker.scan(tracker.start_path,addwatch)
+
+    fullscan()
+    tracker.report()
+    above = threshold > 0 and tracker.total >= threshold
+
+    starttime = time.time()
+    nextreport = starttime + interval
+    try:
+       while not state["stop"]:
+           now = time.time()
+           if duration > 0 and now - starttime >= duration:
+              break
+           wait = max(0,nextreport - now)
+           if duration > 0:
+              wait = min(wait,starttime + duration - now)
+
+           if watcher is not None:
+              # Coalesce events so a file written many times is only stat'ed once per batch
+              dirty = set()
+              for dirpath, name, mask in watcher.read(min(wait,1)):
+                  if watcher is None:
+                     # A watch failed and the tree switched to polling
+                     break
+                  if mask & IN_Q_OVERFLOW:
+                     fullscan()
+                     dirty.clear()
+                  elif dirpath is None:
+                     continue
+                  elif mask & IN_ISDIR:
+                     childpath = os.path.join(dirpath,name)
+                     if mask & (IN_DELETE | IN_MOVED_FROM):
+                        for removed in tracker.removedir(childpath):
+                           watcher.rmwatch(removed)
+                     elif mask & (IN_CREATE | IN_MOVED_TO) and tracker.allowdir(childpath):
+                        tracker.scan(childpath,addwatch)
+                  else:
+                     dirty.add((dirpath,name))
+              for dirpath, name in dirty:
+                  tracker.updatefile(dirpath,name)
+           else:
+              time.sleep(min(wait,1))
+              if time.time() >= nextreport:
+                 tracker.poll()
+
+           if threshold > 0 and (tracker.total >= threshold) != above:
+              above = not above
+              direction = "above" if above else "below"
+              print(f"{time.strftime('%H:%M:%S')}|Threshold {threshold} bytes crossed. Total Size {tracker.total} bytes is {direction} threshold.")
+
+           if state["report"] or time.time() >= nextreport:
+              state["report"] = False
+              nextreport = time.time() + interval
+              tracker.report()
+    except KeyboardInterrupt:
+       pass
+    finally:
+       if watcher is not None:
+          watcher.close()
+
+    tracker.report()
+    return tracker.total
+
 
 #------------------------------------------------
 # Main script logic
@@ -132,6 +1460,33 @@ try: # Try to perform main logic
    parser.add_argument('--dirname', required=True,help="Directory name. Specify IFS path name if dirtype=ifs. If dirtype=library, specify just the library name.")
    parser.add_argument('--listfiles',default=False,required=False,help="List file names")   
    parser.add_argument('--dirtype',default="ifs",required=False,help="Directory naming ifs/library")   
+   parser.add_argument('--duplicates',default=False,required=False,help="Find duplicate files and report reclaimable bytes. Default=False")   
+   parser.add_argument('--workers',default="4",required=False,help="Worker threads used to hash duplicate candidates or processes used by --all-libraries. Default=4")   
+   parser.add_argument('--analytics',default=False,required=False,help="Output size/age histograms and totals by top level directory and extension. Default=False")   
+   parser.add_argument('--olderthan',default="365",required=False,help="Age in days for bytes older than totals in analytics mode. Default=365")   
+   parser.add_argument('--watch',default=False,required=False,help="Keep totals current from change notifications after one initial scan. Default=False")   
+   parser.add_argument('--interval',default="60",required=False,help="Watch mode report/poll interval in seconds. Default=60")   
+   parser.add_argument('--threshold',default="0",required=False,help="Watch mode total size threshold in bytes. 0=No threshold. Default=0")   
+   parser.add_argument('--duration',default="0",required=False,help="Watch mode run time in seconds. 0=Until ended. Default=0")   
+   parser.add_argument('--exclude',action="append",required=False,help="Comma separated glob patterns of directories/files to skip")   
+   parser.add_argument('--excluderegex',action="append",required=False,help="Regular expression of directory/file paths to skip")   
+   parser.add_argument('--include',action="append",required=False,help="Comma separated glob patterns of files to count. Default=All files")   
+   parser.add_argument('--includeregex',action="append",required=False,help="Regular expression of file paths to count. Default=All files")   
+   parser.add_argument('--maxdepth',default="-1",required=False,help="Directory levels to descend. 0=dirname only. -1=No limit. Default=-1")   
+   parser.add_argument('--samefs',default=False,required=False,help="Stay on the file system of dirname. Default=False")   
+   parser.add_argument('--objtypes',default="",required=False,help="Comma separated QSYS.LIB object types to count. Ex: FILE,PGM. Default=All types")   
+   parser.add_argument('--checkpointfile',default="",required=False,help="Save crawl state to this file for --resume. Default=No checkpoints")   
+   parser.add_argument('--checkpointsecs',default="5",required=False,help="Seconds between checkpoint saves. Default=5")   
+   parser.add_argument('--resume',default=False,required=False,help="Resume crawl from --checkpointfile. Default=False")   
+   parser.add_argument('--maxops',default="0",required=False,help="Limit directory reads and stats per second. 0=No limit. Default=0")   
+   parser.add_argument('--adaptive',default=False,required=False,help="Back off while stat latency is above --maxlatencyms. Default=False")   
+   parser.add_argument('--maxlatencyms',default="20",required=False,help="Stat latency in milliseconds that triggers a back off. Default=20")   
+   parser.add_argument('--progresssecs',default="0",required=False,help="Seconds between crawl progress messages. 0=None. Default=0")   
+   parser.add_argument('--all-libraries',default=False,required=False,help="Size every library in --dirname QSYS.LIB directory in parallel. Default=False")   
+   parser.add_argument('--exportdir',default="",required=False,help="Stream file records to bulk load chunk files in this directory. Default=No export")   
+   parser.add_argument('--exportformat',default="csv",required=False,help="Export chunk format csv/jsonl. Default=csv")   
+   parser.add_argument('--exportcompress',default=True,required=False,help="gzip compress export chunks. Default=True")   
+   parser.add_argument('--exportchunkmb',default="100",required=False,help="Uncompressed MB per export chunk. Default=100")   
    # Parse the command line arguments
    args = parser.parse_args()
 
@@ -147,6 +1502,38 @@ try: # Try to perform main logic
       dirname=args.dirname
       
    listfiles=str2bool(str(args.listfiles))
+   duplicates=str2bool(str(args.duplicates))
+   workers=int(args.workers)
+   analytics=str2bool(str(args.analytics))
+   olderthan=int(args.olderthan)
+   watch=str2bool(str(args.watch))
+   interval=float(args.interval)
+   threshold=int(args.threshold)
+   duration=float(args.duration)
+   checkpointfile=args.checkpointfile.strip()
+   checkpointsecs=float(args.checkpointsecs)
+   resume=str2bool(str(args.resume))
+   alllibraries=str2bool(str(args.all_libraries))
+   exportdir=args.exportdir.strip()
+
+   # Pace the crawl if a rate limit or progress messages were requested
+   maxops=float(args.maxops)
+   progresssecs=float(args.progresssecs)
+   limiter=None
+   if (maxops > 0 or progresssecs > 0):
+      limiter=IoRateLimiter(maxops,str2bool(str(args.adaptive)),float(args.maxlatencyms),progresssecs)
+
+   # Checkpoints hold the running total, so they only apply when calculating the total size
+   if (resume and checkpointfile==""):
+      raise Exception("--resume requires --checkpointfile. Process cancelled.")
+   if (checkpointfile!="" and (duplicates or analytics or watch or alllibraries)):
+      raise Exception("--checkpointfile is only supported when calculating total size or exporting. Process cancelled.")
+
+   # Compile the walk rules once for all modes
+   rules=WalkRules(splitpatterns(args.exclude),args.excluderegex,
+                   splitpatterns(args.include),args.includeregex,
+                   int(args.maxdepth),str2bool(str(args.samefs)),
+                   splitpatterns([args.objtypes]))
 
    #Output IFS path to list
    print(f"IFS dir path to list: {dirname}")
@@ -154,14 +1541,102 @@ try: # Try to perform main logic
    # Bail if directory not found
    if not (os.path.isdir(dirname)):
       raise Exception(f"{dirname} not found. Process cancelled.")
+   rules.setroot(dirname)
+
+   if (alllibraries):
+      # Size each library on a process pool and list them largest first
+      libsizes=getalllibsizes(dirname,workers,rules,maxops)
+      totsize=0
+      print(f"library|objtype|objcount|totalsize")
+      for libname, libsize, totals, members in libsizes:
+         totsize+=libsize
+         print(f"{libname}|*ALL|{sum(t[0] for t in totals.values())}|{libsize}")
+         for objtype, (objcount, objsize) in sorted(totals.items(),key=lambda t: t[1][1],reverse=True):
+            print(f"{libname}|{objtype}|{objcount}|{objsize}")
+         # Members are already counted in their .FILE size
+         if members[0] > 0:
+            print(f"{libname}|.MBR|{members[0]}|{members[1]}")
+      print(f"Libraries: {len(libsizes)}")
+      print(f"Total Size: {totsize} bytes")
+
+      # Set success info and output total size
+      exitcode=0
+      exitmessage=f"Total Size: {totsize} bytes in {len(libsizes)} libraries"
+   elif (exportdir!=""):
+      # Stream file records into bulk load chunks while crawling
+      chunkbytes=int(float(args.exportchunkmb) * 1048576)
+      if (chunkbytes < 1):
+         raise Exception(f"--exportchunkmb must be greater than 0. Value passed: {args.exportchunkmb}. Process cancelled.")
+      exporter=CrawlExporter(exportdir,args.exportformat.lower(),str2bool(str(args.exportcompress)),chunkbytes)
+      totsize=exportdircrawl(dirname,exporter,rules,limiter,checkpointfile,resume)
+      for chunk in exporter.chunks:
+         print(f"Export chunk: {chunk['file']} rows: {chunk['rows']} bytes: {chunk['bytes']}")
+      print(f"Exported Rows: {exporter.rows} to {exportdir}")
+      print(f"Total Size: {totsize} bytes")
 
-   # Process directory and return size
-   totsize=getdirsize(dirname,listfiles)
-   print(f"Total Size: {totsize} bytes")
+      # Set success info and output total size
+      exitcode=0
+      exitmessage=f"Exported {exporter.rows} rows in {len(exporter.chunks)} chunks. Total Size: {totsize} bytes"
+   elif (duplicates):
+      # Process directory and return duplicate file groups
+      dupgroups=finddupfiles(dirname,workers,rules=rules,limiter=limiter)
+      totreclaim=0
+      totdupfiles=0
+      print(f"filesize|filecount|reclaimable")
+      for size, paths in dupgroups:
+         reclaim=size * (len(paths) - 1)
+         totreclaim+=reclaim
+         totdupfiles+=len(paths) - 1
+         print(f"{size}|{len(paths)}|{reclaim}")
+         # List duplicate file names if enabled
+         if (listfiles):
+            for fp in paths:
+               print(f"  {fp}")
+      print(f"Duplicate Groups: {len(dupgroups)}")
+      print(f"Duplicate Files: {totdupfiles}")
+      print(f"Reclaimable Size: {totreclaim} bytes")
+
+      # Set success info and output reclaimable size
+      exitcode=0
+      exitmessage=f"Reclaimable Size: {totreclaim} bytes in {len(dupgroups)} duplicate groups"
+   elif (watch):
+      # Scan directory once then track changes until duration expires or job is ended
+      totsize=watchdirsize(dirname,interval,threshold,duration,rules)
+
+      # Set success info and output total size
+      exitcode=0
+      exitmessage=f"Total Size: {totsize} bytes"
+   elif (analytics):
+      # Process directory into stat arrays and compute histograms
+      stats=getdirstats(dirname,rules,limiter)
+      results=getdiranalytics(stats,olderthan)
+      totsize=sum(r[2] for r in results["byage"])
+      print(f"agedays|filecount|totalsize")
+      for label, count, size in results["byage"]:
+         print(f"{label}|{count}|{size}")
+      print(f"sizebytes|filecount|totalsize")
+      for label, count, size in results["bysize"]:
+         print(f"{label}|{count}|{size}")
+      print(f"extension|filecount|totalsize")
+      for label, count, size in results["byext"]:
+         print(f"{label}|{count}|{size}")
+      print(f"topdir|filecount|totalsize|oldfilecount|oldsize")
+      for label, count, size, oldcount, oldsize in results["bytopdir"]:
+         print(f"{label}|{count}|{size}|{oldcount}|{oldsize}")
+      print(f"Total Files: {len(stats['size'])}")
+      print(f"Total Size: {totsize} bytes")
+
+      # Set success info and output total size
+      exitcode=0
+      exitmessage=f"Total Size: {totsize} bytes"
+   else:
+      # Process directory and return size
+      totsize=getdirsize(dirname,listfiles,rules,checkpointfile,checkpointsecs,resume,limiter)
+      print(f"Total Size: {totsize} bytes")
       
-   # Set success info and output total size
-   exitcode=0
-   exitmessage=f"Total Size: {totsize} bytes"
+      # Set success info and output total size
+      exitcode=0
+      exitmessage=f"Total Size: {totsize} bytes"
 
 #------------------------------------------------
 # Handle Exceptions
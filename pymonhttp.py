@@ -16,9 +16,22 @@
 # --scanvalue - Text value to scan results for if scanresults enabled.
 # --ignorecase - Ignore case when scanning results if scanning results enabled. True/False Default=True
 # --echoresults - Echo results to command line/stdout. If you want to capture the HTTP resonse or are debugging.
+# --concurrency - Load test mode. Number of concurrent connections. Each connection is kept open and reused. Must be 1 or more. Default=1
+# --requests - Load test mode. Total number of requests to send. 0=Use --duration. Default=0
+# --duration - Load test mode. Seconds to send requests for when --requests is 0. Default=0
+#              Load test mode is used when --requests or --duration is set. Requests per second, error rate
+#              and a latency histogram are output. The --scanvalue check is applied to every response.
+# --maxerrorrate - Load test mode. Fail when the percent of failed requests is above this value. Default=No limit
+# --cachesecs - Share check results between jobs for this many seconds. A job running the same check
+#               within the window gets the cached result, and a job starting the same check while it
+#               is running waits for that result instead of sending another request. 0=No caching. Default=0
+# --cachedir - Directory for shared check results and lock files. It is created writable by all user
+#              profiles. Point it at a directory owned by a group to share results only within that
+#              group. If the cache can't be used the check runs without it. Default=/tmp/pymoncache
 #
 # Pip packages needed:
 # https://pypi.org/project/httpie - pip3 install httpie
+# Load test mode only uses the standard http.client module.
 #
 # Returns:
 # Exits with 0 on success or 99 on errors.
@@ -41,6 +54,12 @@ import re
 import time
 import traceback
 import subprocess
+import threading
+import http.client
+import hashlib
+import json
+import fcntl
+from array import array
 
 
 #------------------------------------------------
@@ -96,6 +115,291 @@ def ltrim(strval):
     #-------------------------------------------------------
     return strval.lstrip()
 
+# Load test latency histogram bucket upper bounds in milliseconds
+LATENCY_BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+
+def splithost(host):
+    #-------------------------------------------------------
+    # Function: splithost
+    # Desc: Split a host parameter into host[:port] and path
+    # :host: Host name with optional port and path. Ex: myibmi:10080/index.html
+    # :return: Tuple of (host[:port], path)
+    #-------------------------------------------------------
+    host = re.sub(r"^https?://","",host,flags=re.IGNORECASE)
+    netloc, sep, path = host.partition("/")
+    return netloc, "/" + path
+
+def percentile(sortedvalues,pct):
+    #-------------------------------------------------------
+    # Function: percentile
+    # Desc: Nearest rank percentile of sorted values
+    # :sortedvalues: Sorted list of values
+    # :pct: Percentile between 0 and 100
+    # :return: Percentile value or 0 if there are no values
+    #-------------------------------------------------------
+    if len(sortedvalues) == 0:
+       return 0
+    rank = max(1,int(-(-pct * len(sortedvalues) // 100)))
+    return sortedvalues[rank - 1]
+
+def runloadtest(host,secure,timeout,concurrency,requests,duration,scanvalue="",ignorecase=True):
+    #-------------------------------------------------------
+    # Function: runloadtest
+    # Desc: Send GET requests from concurrent worker threads. Each worker
+    #       keeps its own persistent connection open and reuses it, so the
+    #       workers act as a connection pool. A failed connection is
+    #       closed and reopened on the next request.
+    # :host: Host name with optional port and path
+    # :secure: True=https, False=http
+    # :timeout: Request timeout in seconds
+    # :concurrency: Number of worker threads/connections
+    # :requests: Total requests to send. 0=Send until duration has passed
+    # :duration: Seconds to send requests for when requests is 0
+    # :scanvalue: Text each response must contain. Blank=No scan
+    # :ignorecase: Ignore case when scanning responses
+    # :return: Dictionary with count, errors, elapsed seconds, latency ms
+    #          array and error messages by count
+    #-------------------------------------------------------
+    netloc, path = splithost(host)
+    scanbytes = scanvalue.lower().encode() if ignorecase else scanvalue.encode()
+    lock = threading.Lock()
+    results = {"count": 0, "errors": 0, "latencies": array('d'), "errormsgs": {}}
+    state = {"issued": 0}
+    starttime = time.monotonic()
+    endtime = starttime + duration
+
+    def nextrequest():
+        # Claim the next request number. False once the run is over.
+        with lock:
+           if requests > 0:
+              if state["issued"] >= requests:
+                 return False
+           elif time.monotonic() >= endtime:
+              return False
+           state["issued"] += 1
+           return True
+
+    def worker():
+        conn = None
+        while nextrequest():
+            error = None
+            reqstart = time.monotonic()
+            try:
+               if conn is None:
+                  if secure:
+                     conn = http.client.HTTPSConnection(netloc,timeout=timeout)
+                  else:
+                     conn = http.client.HTTPConnection(netloc,timeout=timeout)
+               conn.request("GET",path)
+               response = conn.getresponse()
+               body = response.read()
+               if response.status >= 400:
+                  error = f"HTTP status {response.status}"
+               elif scanbytes and scanbytes not in (body.lower() if ignorecase else body):
+                  error = f"{scanvalue} not found in response"
+               if response.will_close:
+                  conn.close()
+                  conn = None
+            except (OSError,http.client.HTTPException) as ex:
+               error = f"{type(ex).__name__}: {ex}"
+               if conn is not None:
+                  conn.close()
+               conn = None
+            latency = (time.monotonic() - reqstart) * 1000
+            with lock:
+               results["count"] += 1
+               results["latencies"].append(latency)
+               if error is not None:
+                  results["errors"] += 1
+                  results["errormsgs"][error] = results["errormsgs"].get(error,0) + 1
+        if conn is not None:
+           conn.close()
+
+    threads = [threading.Thread(target=worker) for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    results["elapsed"] = time.monotonic() - starttime
+    return results
+
+def printloadtest(results):
+    #-------------------------------------------------------
+    # Function: printloadtest
+    # Desc: Output load test throughput, error rate and latency histogram
+    # :results: Dictionary returned by runloadtest
+    # :return: Error rate percent
+    #-------------------------------------------------------
+    count = results["count"]
+    latencies = sorted(results["latencies"])
+    errorrate = 100.0 * results["errors"] / count if count > 0 else 0.0
+    print(f"Requests: {count} Errors: {results['errors']} Error rate: {errorrate:.2f}%")
+    print(f"Elapsed: {results['elapsed']:.2f} seconds Requests/sec: {count / max(results['elapsed'],0.001):.1f}")
+    print(f"Latency ms p50/p95/p99/max: {percentile(latencies,50):.1f}/{percentile(latencies,95):.1f}/"
+          f"{percentile(latencies,99):.1f}/{(latencies[-1] if latencies else 0):.1f}")
+    print("latencyms|requests|percent")
+    lows = [0] + LATENCY_BUCKETS
+    counts = [0] * (len(LATENCY_BUCKETS) + 1)
+    bucket = 0
+    for latency in latencies:
+        while bucket < len(LATENCY_BUCKETS) and latency >= LATENCY_BUCKETS[bucket]:
+           bucket += 1
+        counts[bucket] += 1
+    for i, c in enumerate(counts):
+        label = f"{lows[i]}-{LATENCY_BUCKETS[i]}" if i < len(LATENCY_BUCKETS) else f">={LATENCY_BUCKETS[-1]}"
+        print(f"{label}|{c}|{100.0 * c / max(count,1):.1f}")
+    for msg, c in sorted(results["errormsgs"].items(),key=lambda e: e[1],reverse=True):
+        print(f"Error: {msg} ({c})")
+    return errorrate
+
+
+def runhttpcheck(cmd,host,scanresults,scanvalue,ignorecase,echoresults):
+    #-------------------------------------------------------
+    # Function: runhttpcheck
+    # Desc: Run a single site check with httpie and optionally scan the response
+    # :cmd: httpie command line to run
+    # :host: Host name for messages
+    # :scanresults: True=Scan response for scanvalue
+    # :scanvalue: Text value to scan for
+    # :ignorecase: Ignore case when scanning
+    # :echoresults: Echo response to stdout
+    # :return: Success message. Raises an exception if the check fails.
+    #-------------------------------------------------------
+
+    # Run the external http or https command line using HTTPIe (HTTPIe must be installed)
+    proc = subprocess.Popen([cmd], stdout=subprocess.PIPE, shell=True) 
+
+    # Get stdout info from subprocess command
+    (out, err) = proc.communicate() 
+
+    # Subprocess return code
+    subrtncode = proc.poll() 
+
+    # Bail if subprocess return code wasn't 0 for success
+    if (subrtncode!=0):
+       raise Exception(f"Http call failed with return code: {subrtncode}")
+
+    # Echo HTTP results to console if enabled
+    if (echoresults):
+       print("subprocess output:", out)
+
+    # Move results to string variable 
+    outstr=str(out)
+
+    #Equalize case if ignoring case    
+    if (ignorecase):
+        outstr=outstr.lower()
+        scanvalue=scanvalue.lower()
+   
+    # If enabled, scan for string value in results and bail if not found
+    if (scanresults):
+       foundindex = outstr.find(scanvalue) #Locate substring
+       if (foundindex < 0):
+          raise Exception(f"{scanvalue} Not found in http call response data. Process cancelled.")           
+        
+       # Return success info
+       return f"Http call completed successfully. {scanvalue} found in response."
+    else:
+       # Return success info
+       return f"Http call completed successfully. Site {host} appears to be responding."
+
+def getcachekey(params):
+    #-------------------------------------------------------
+    # Function: getcachekey
+    # Desc: Build a cache key from normalized check parameters
+    # :params: Dictionary of check parameters
+    # :return: Hex key usable as a file name
+    #-------------------------------------------------------
+    return hashlib.sha1(json.dumps(params,sort_keys=True).encode()).hexdigest()
+
+def opencachefile(path,flags):
+    #-------------------------------------------------------
+    # Function: opencachefile
+    # Desc: Open a cache file readable and writable by every user profile
+    #       so jobs running under different profiles can share it. The
+    #       umask is undone with fchmod when this job owns the file.
+    # :path: File path
+    # :flags: os.open flags
+    # :return: File descriptor
+    #-------------------------------------------------------
+    fd = os.open(path,flags,0o666)
+    try:
+       os.fchmod(fd,0o666)
+    except OSError:
+       pass
+    return fd
+
+def runcachedcheck(cachedir,cachesecs,params,checkfunc):
+    #-------------------------------------------------------
+    # Function: runcachedcheck
+    # Desc: Share one check result between jobs running the same check.
+    #       An exclusive lock on the key's lock file is held while the
+    #       cached result is read and, if it is too old, while the check
+    #       runs. A job asking for the same check while it is running
+    #       waits on the lock and then gets the fresh result instead of
+    #       starting another probe. The cache directory and files are
+    #       created writable by all profiles. If the cache can't be used
+    #       the check still runs without it, so the cache never fails a check.
+    # :cachedir: Directory for the cache and lock files
+    # :cachesecs: Seconds a cached result stays fresh
+    # :params: Dictionary of normalized check parameters used as the key
+    # :checkfunc: Function that runs the check and returns a success
+    #             message or raises an exception on failure
+    # :return: Dictionary with ok, message, time and cached values
+    #-------------------------------------------------------
+    def runcheck():
+        try:
+           result = {"ok": True, "message": checkfunc()}
+        except Exception as ex:
+           result = {"ok": False, "message": str(ex)}
+        result["time"] = time.time()
+        result["cached"] = False
+        return result
+
+    key = getcachekey(params)
+    resultfile = os.path.join(cachedir,key + ".json")
+    try:
+       if not os.path.isdir(cachedir):
+          os.makedirs(cachedir,exist_ok=True)
+          try:
+             os.chmod(cachedir,0o777)
+          except OSError:
+             pass
+       lockfd = opencachefile(os.path.join(cachedir,key + ".lock"),os.O_RDWR | os.O_CREAT)
+    except OSError as ex:
+       print(f"Warning: Result cache not available. {ex}. Running check without the cache.")
+       return runcheck()
+
+    try:
+       try:
+          fcntl.lockf(lockfd,fcntl.LOCK_EX)
+       except OSError as ex:
+          print(f"Warning: Result cache lock failed. {ex}. Running check without the cache.")
+          return runcheck()
+       try:
+          with open(resultfile,"r") as f:
+             result = json.load(f)
+          if time.time() - result["time"] <= cachesecs:
+             result["cached"] = True
+             return result
+       except (OSError,ValueError,KeyError):
+          pass
+
+       result = runcheck()
+       try:
+          # Write to a temp file and rename so readers never see a partial result
+          tmpfile = resultfile + ".tmp"
+          with os.fdopen(opencachefile(tmpfile,os.O_WRONLY | os.O_CREAT | os.O_TRUNC),"w") as f:
+             json.dump(dict(result,params=params),f)
+          os.replace(tmpfile,resultfile)
+       except OSError as ex:
+          print(f"Warning: Result cache not saved. {ex}")
+       return result
+    finally:
+       # Closing the lock file releases the lock
+       os.close(lockfd)
+
 
 #------------------------------------------------
 # Main script logic
@@ -114,6 +418,12 @@ try: # Try to perform main logic
    parser.add_argument('--scanvalue',default="",required=False,help="Scan for text value in valid response. Default=blanks")
    parser.add_argument('--ignorecase',default=True,required=False,help="Ignore case when scanning for value. Default=True")   
    parser.add_argument('--echoresults',default=False,required=False,help="Echo results to stdout. Default=False")   
+   parser.add_argument('--concurrency',default="1",required=False,help="Load test concurrent connections. Default=1")   
+   parser.add_argument('--requests',default="0",required=False,help="Load test total requests. 0=Use --duration. Default=0")   
+   parser.add_argument('--duration',default="0",required=False,help="Load test seconds when --requests is 0. Default=0")   
+   parser.add_argument('--maxerrorrate',default="",required=False,help="Load test failed request percent limit. Default=No limit")   
+   parser.add_argument('--cachesecs',default="0",required=False,help="Seconds to share check results between jobs. 0=No caching. Default=0")   
+   parser.add_argument('--cachedir',default="/tmp/pymoncache",required=False,help="Shared check result directory. Default=/tmp/pymoncache")   
    # Parsse the command line arguments 
    args = parser.parse_args()
 
@@ -125,6 +435,14 @@ try: # Try to perform main logic
    scanvalue=args.scanvalue
    echoresults=str2bool(str(args.echoresults))
    scanresults=str2bool(str(args.scanresults))   
+   concurrency=int(args.concurrency)
+   requests=int(args.requests)
+   duration=float(args.duration)
+   maxerrorrate=float(args.maxerrorrate) if args.maxerrorrate != "" else None
+   cachesecs=float(args.cachesecs)
+   cachedir=args.cachedir
+   if (concurrency < 1):
+      raise Exception(f"--concurrency must be 1 or more. Value passed: {concurrency}. Process cancelled.")
 
    # Template commands
    # use http or https
@@ -142,44 +460,39 @@ try: # Try to perform main logic
    print(f"cmd: {cmd}")
    print(f"scanvalue: {scanvalue}")
 
-   # Run the external http or https command line using HTTPIe (HTTPIe must be installed)
-   proc = subprocess.Popen([cmd], stdout=subprocess.PIPE, shell=True) 
-
-   # Get stdout info from subprocess command
-   (out, err) = proc.communicate() 
-
-   # Subprocess return code
-   subrtncode = proc.poll() 
-
-   # Bail if subprocess return code wasn't 0 for success
-   if (subrtncode!=0):
-      raise Exception(f"Http call failed with return code: {subrtncode}")
-
-   # Echo HTTP results to console if enabled
-   if (echoresults):
-      print("subprocess output:", out)
-
-   # Move results to string variable 
-   outstr=str(out)
-
-   #Equalize case if ignoring case    
-   if (ignorecase):
-       outstr=outstr.lower()
-       scanvalue=scanvalue.lower()
-   
-   # If enabled, scan for string value in results and bail if not found
-   if (scanresults):
-      foundindex = outstr.find(scanvalue) #Locate substring
-      if (foundindex < 0):
-         raise Exception(f"{scanvalue} Not found in http call response data. Process cancelled.")           
-        
-      # Set success info
+   # Load test mode drives concurrent requests over pooled connections instead of one httpie call
+   if (requests > 0 or duration > 0):
+      print(f"Load test: concurrency {concurrency} requests {requests} duration {duration}")
+      results=runloadtest(host,secure,float(timeout),concurrency,requests,duration,
+                          scanvalue if scanresults else "",ignorecase)
+      errorrate=printloadtest(results)
+      if (results["count"] > 0 and results["errors"] == results["count"]):
+         # Report the most common error so a failed scan isn't mistaken for a site that is down
+         topmsg, topcount = max(results["errormsgs"].items(),key=lambda e: e[1])
+         raise Exception(f"All {results['count']} load test requests failed. Most common error ({topcount} requests): {topmsg}")
+      if (maxerrorrate is not None and errorrate > maxerrorrate):
+         raise Exception(f"Load test error rate {errorrate:.2f}% is above {maxerrorrate}%. Process cancelled.")
       exitcode=0
-      exitmessage=f"Http call completed successfully. {scanvalue} found in response."
+      exitmessage=f"Load test completed. {results['count'] / max(results['elapsed'],0.001):.1f} requests/sec. Error rate {errorrate:.2f}%."
    else:
-      # Set success info
+      # Run the single site check, sharing the result with other jobs if caching is enabled
+      checkfunc=lambda: runhttpcheck(cmd,host,scanresults,scanvalue,ignorecase,echoresults)
+      if (cachesecs > 0):
+         # Only the scheme and host[:port] are case insensitive. The path and query are kept as given.
+         scheme=re.match(r"^(https?://)?",host.strip(),flags=re.IGNORECASE).group(0).lower()
+         netloc,path=splithost(host.strip())
+         params={"check": "http", "host": scheme + netloc.lower() + path, "secure": secure, "timeout": timeout,
+                 "scanresults": scanresults, "ignorecase": ignorecase,
+                 "scanvalue": scanvalue.lower() if ignorecase else scanvalue}
+         result=runcachedcheck(cachedir,cachesecs,params,checkfunc)
+         if (result["cached"]):
+            print(f"Using cached result from {time.time() - result['time']:.1f} seconds ago")
+         if not (result["ok"]):
+            raise Exception(result["message"])
+         exitmessage=result["message"]
+      else:
+         exitmessage=checkfunc()
       exitcode=0
-      exitmessage=f"Http call completed successfully. Site {host} appears to be responding."
         
 #------------------------------------------------
 # Handle Exceptions
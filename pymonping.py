@@ -16,12 +16,31 @@
 # --packets - number of packets
 # Valid formats: --packets=3 
 #
+# --runs - Number of times to run PING. Round-trip stats are accumulated across runs. Default=1
+# --runinterval - Seconds to wait between runs. Default=0
+# --statsfile - File used to accumulate round-trip stats across script calls. Default=No stats file
+# --resetstats - Start the stats file over. True/False Default=False
+# --max-loss - Fail when packet loss percent for the runs in this call is above this value. Default=No limit
+# --max-p95-ms - Fail when the 95th percentile round-trip time in milliseconds for the runs
+#                in this call is above this value. Default=No limit
+#
 # Pip packages needed:
 # None - argparse is a standard module.
 #
 # Returns:
-# Exits with 0 on success or 99 on errors.
+# Exits with 0 on success or 99 on errors or when a threshold is exceeded.
 # This allows us to communicate back to command line with an appropriate return code.
+# Round-trip stats are output as return parameter values. If a stats file is used
+# the values are accumulated across all calls since the stats file was reset.
+# Runs with no replies are recorded as total packet loss before the error is returned.
+# RETURNPARM01 - Packet loss percent
+# RETURNPARM02 - Minimum round-trip milliseconds
+# RETURNPARM03 - Average round-trip milliseconds
+# RETURNPARM04 - Maximum round-trip milliseconds
+# RETURNPARM05 - Jitter milliseconds. Average difference between consecutive round-trips.
+# RETURNPARM06 - 50th percentile round-trip milliseconds
+# RETURNPARM07 - 95th percentile round-trip milliseconds
+# RETURNPARM08 - 99th percentile round-trip milliseconds
 #
 #------------------------------------------------
 # Web Links
@@ -39,6 +58,9 @@ import os
 import re
 import time
 import traceback
+import subprocess
+import json
+import math
 
 
 #------------------------------------------------
@@ -95,6 +117,143 @@ def ltrim(strval):
     #-------------------------------------------------------
     return strval.lstrip()
 
+class RttSketch:
+    #-------------------------------------------------------
+    # Class: RttSketch
+    # Desc: Fixed memory streaming quantile sketch for round-trip times.
+    #       Values are counted in logarithmic buckets so any quantile is
+    #       returned within the relative accuracy, no matter how many
+    #       values were added. When there are more than max_buckets the
+    #       lowest buckets are merged, which only affects low quantiles.
+    #-------------------------------------------------------
+
+    def __init__(self,accuracy=0.01,max_buckets=1024):
+        self.accuracy = accuracy
+        self.maxbuckets = max_buckets
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.loggamma = math.log(self.gamma)
+        self.buckets = {}  # bucket index -> count
+        self.zeros = 0     # values under 1 microsecond, IBM i PING reports 0 ms on fast links
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self,value):
+        #-------------------------------------------------------
+        # Function: add
+        # Desc: Add a value to the sketch
+        # :value: Round-trip time in milliseconds
+        #-------------------------------------------------------
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min,value)
+        self.max = value if self.max is None else max(self.max,value)
+        if value < 0.001:
+           self.zeros += 1
+           return
+        index = math.ceil(math.log(value) / self.loggamma)
+        self.buckets[index] = self.buckets.get(index,0) + 1
+        if len(self.buckets) > self.maxbuckets:
+           low = sorted(self.buckets)[:2]
+           self.buckets[low[1]] += self.buckets.pop(low[0])
+
+    def quantile(self,q):
+        #-------------------------------------------------------
+        # Function: quantile
+        # Desc: Estimate a quantile
+        # :q: Quantile between 0 and 1. Ex: 0.95
+        # :return: Estimated value or None if the sketch is empty
+        #-------------------------------------------------------
+        if self.count == 0:
+           return None
+        rank = q * (self.count - 1)
+        seen = self.zeros
+        if rank < seen:
+           return 0.0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if rank < seen:
+               value = 2 * self.gamma ** index / (self.gamma + 1)
+               return min(max(value,self.min),self.max)
+        return self.max
+
+    def todict(self):
+        return {"accuracy": self.accuracy, "maxbuckets": self.maxbuckets,
+                "buckets": {str(k): v for k, v in self.buckets.items()},
+                "zeros": self.zeros, "count": self.count, "sum": self.sum,
+                "min": self.min, "max": self.max}
+
+    @classmethod
+    def fromdict(cls,data):
+        sketch = cls(data["accuracy"],data["maxbuckets"])
+        sketch.buckets = {int(k): v for k, v in data["buckets"].items()}
+        sketch.zeros = data["zeros"]
+        sketch.count = data["count"]
+        sketch.sum = data["sum"]
+        sketch.min = data["min"]
+        sketch.max = data["max"]
+        return sketch
+
+def parsepingoutput(outstr):
+    #-------------------------------------------------------
+    # Function: parsepingoutput
+    # Desc: Parse the replies and summary from PING MSGMODE(*VERBOSE) output.
+    #       Unix style ping output is also understood for testing.
+    # :outstr: PING command output
+    # :return: Tuple of (packets sent or None, packets received or None, [round-trip ms])
+    #-------------------------------------------------------
+    # TCP3215: PING reply 1 from 8.8.8.8 took 12 ms. 256 bytes. TTL 117.
+    # 64 bytes from 8.8.8.8: icmp_seq=1 ttl=117 time=12.3 ms
+    rtts = [float(v) for v in re.findall(r"(?:took|time=)\s*([0-9.]+)\s*ms",outstr,re.IGNORECASE)]
+    sent = None
+    received = None
+    # TCP3210: Connection verification statistics: 3 of 3 successful (100 %).
+    match = re.search(r"(\d+)\s+of\s+(\d+)\s+successful",outstr,re.IGNORECASE)
+    if match:
+       received = int(match.group(1))
+       sent = int(match.group(2))
+    # 3 packets transmitted, 3 received, 0% packet loss
+    match = re.search(r"(\d+)\s+packets transmitted,\s+(\d+)\s+(?:packets )?received",outstr)
+    if match:
+       sent = int(match.group(1))
+       received = int(match.group(2))
+    return sent, received, rtts
+
+def loadpingstats(statsfile,reset=False):
+    #-------------------------------------------------------
+    # Function: loadpingstats
+    # Desc: Load accumulated ping stats or start new stats
+    # :statsfile: Stats file path or blank for no stats file
+    # :reset: True=Ignore any saved stats
+    # :return: Dictionary of accumulated stats
+    #-------------------------------------------------------
+    stats = {"sent": 0, "received": 0, "jittersum": 0.0, "jittercount": 0, "sketch": RttSketch()}
+    if statsfile != "" and not reset and os.path.isfile(statsfile):
+       with open(statsfile,"r") as f:
+          data = json.load(f)
+       stats.update(data)
+       stats["sketch"] = RttSketch.fromdict(data["sketch"])
+    return stats
+
+def savepingstats(statsfile,stats):
+    #-------------------------------------------------------
+    # Function: savepingstats
+    # Desc: Atomically save accumulated ping stats
+    # :statsfile: Stats file path
+    # :stats: Dictionary of accumulated stats
+    #-------------------------------------------------------
+    data = dict(stats)
+    data["sketch"] = stats["sketch"].todict()
+    tmpfile = statsfile + ".tmp"
+    with open(tmpfile,"w") as f:
+       json.dump(data,f)
+    os.replace(tmpfile,statsfile)
+
+def fmtms(value):
+    # Format milliseconds for output. Blank if there is no value yet.
+    return "" if value is None else f"{value:.2f}"
+
 
 #------------------------------------------------
 # Main script logic
@@ -108,12 +267,24 @@ try: # Try to perform main logic
    parser = argparse.ArgumentParser()
    parser.add_argument('--host', required=True,help="Host name or ip address to ping is required")
    parser.add_argument('-p','--packets',default="3",required=False,help="Number of packets")   
+   parser.add_argument('--runs',default="1",required=False,help="Number of times to run PING. Default=1")   
+   parser.add_argument('--runinterval',default="0",required=False,help="Seconds between runs. Default=0")   
+   parser.add_argument('--statsfile',default="",required=False,help="File to accumulate round-trip stats across calls. Default=None")   
+   parser.add_argument('--resetstats',default=False,required=False,help="Start the stats file over. Default=False")   
+   parser.add_argument('--max-loss',default="",required=False,help="Fail when packet loss percent for this call's runs is above this value. Default=No limit")   
+   parser.add_argument('--max-p95-ms',default="",required=False,help="Fail when 95th percentile round-trip ms for this call's runs is above this value. Default=No limit")   
    # Parsse the command line arguments 
    args = parser.parse_args()
 
    # Convert args to variables
    host=args.host
    packets=args.packets
+   runs=int(args.runs)
+   runinterval=float(args.runinterval)
+   statsfile=args.statsfile.strip()
+   resetstats=str2bool(str(args.resetstats))
+   maxloss=float(args.max_loss) if args.max_loss != "" else None
+   maxp95=float(args.max_p95_ms) if args.max_p95_ms != "" else None
 
    # Template commands
    # Run ping and send escape on errors
@@ -122,13 +293,81 @@ try: # Try to perform main logic
    # Argument parsing is done. Let's do some work
    print(f"host: {host}")
 
-   # Run CL command
+   # Load round-trip stats from earlier calls if a stats file is used
+   stats=loadpingstats(statsfile,resetstats)
+   sketch=stats["sketch"]
+
+   # Thresholds are checked against this call's runs only so a new
+   # degradation is not hidden by a long history in the stats file
+   callsent=0
+   callreceived=0
+   callsketch=RttSketch()
+   failedruns=0
+
+   # Run CL command and capture the verbose output so the replies can be parsed
    cmd = "system -v \"" + cmdtemplate + "\""
-   rtnsys=os.system(cmd)
-   ##rtnsys=os.system(f"system -v \'{srctemplate}\'")
-   
-   if rtnsys != 0:
-      raise Exception('Error occurred running PING command. Process cancelled.')           
+   for run in range(runs):
+      if run > 0:
+         time.sleep(runinterval)
+      proc=subprocess.run(cmd,shell=True,stdout=subprocess.PIPE,stderr=subprocess.STDOUT,universal_newlines=True)
+      print(proc.stdout,end="")
+      sent,received,rtts=parsepingoutput(proc.stdout)
+
+      # No replies at all is still an error like before, but the run is
+      # recorded as total loss and the error is raised after stats are saved
+      if proc.returncode != 0 and len(rtts)==0:
+         failedruns+=1
+         received=0
+
+      # Accumulate this run's round-trip times and jitter
+      sent=sent if sent is not None else int(packets)
+      received=received if received is not None else len(rtts)
+      stats["sent"]+=sent
+      stats["received"]+=received
+      callsent+=sent
+      callreceived+=received
+      for rtt in rtts:
+         sketch.add(rtt)
+         callsketch.add(rtt)
+      for prev,curr in zip(rtts,rtts[1:]):
+         stats["jittersum"]+=abs(curr - prev)
+         stats["jittercount"]+=1
+
+   if statsfile != "":
+      savepingstats(statsfile,stats)
+
+   # Output round-trip stats
+   loss=100.0 * (stats["sent"] - stats["received"]) / stats["sent"] if stats["sent"] > 0 else 0.0
+   avg=sketch.sum / sketch.count if sketch.count > 0 else None
+   jitter=stats["jittersum"] / stats["jittercount"] if stats["jittercount"] > 0 else None
+   p95=sketch.quantile(0.95)
+   if statsfile != "":
+      print(f"This call packets sent: {callsent} received: {callreceived}")
+   print(f"Packets sent: {stats['sent']} received: {stats['received']} loss: {loss:.1f}%")
+   print(f"Round-trip ms min/avg/max/jitter: {fmtms(sketch.min)}/{fmtms(avg)}/{fmtms(sketch.max)}/{fmtms(jitter)}")
+   print(f"Round-trip ms p50/p95/p99: {fmtms(sketch.quantile(0.5))}/{fmtms(p95)}/{fmtms(sketch.quantile(0.99))}")
+
+   # Output return parameter values to STDOUT log info
+   # Return info keywords start with: RETURNPARMxx:
+   print(f'RETURNPARM01:{loss:.1f}')
+   print(f'RETURNPARM02:{fmtms(sketch.min)}')
+   print(f'RETURNPARM03:{fmtms(avg)}')
+   print(f'RETURNPARM04:{fmtms(sketch.max)}')
+   print(f'RETURNPARM05:{fmtms(jitter)}')
+   print(f'RETURNPARM06:{fmtms(sketch.quantile(0.5))}')
+   print(f'RETURNPARM07:{fmtms(p95)}')
+   print(f'RETURNPARM08:{fmtms(sketch.quantile(0.99))}')
+
+   if failedruns > 0:
+      raise Exception(f'Error occurred running PING command. {failedruns} of {runs} runs had no replies. Process cancelled.')           
+
+   # Alert on a degrading link before it goes fully down
+   callloss=100.0 * (callsent - callreceived) / callsent if callsent > 0 else 0.0
+   callp95=callsketch.quantile(0.95)
+   if maxloss is not None and callloss > maxloss:
+      raise Exception(f"Packet loss {callloss:.1f}% is above --max-loss {maxloss}%. Process cancelled.")
+   if maxp95 is not None and callp95 is not None and callp95 > maxp95:
+      raise Exception(f"95th percentile round-trip {callp95:.2f} ms is above --max-p95-ms {maxp95} ms. Process cancelled.")
       
    # Set success info
    exitcode=0